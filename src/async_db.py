@@ -0,0 +1,152 @@
+"""asyncio front end for DatabaseManager"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import DatabaseManager
+
+DEFAULT_READERS = 4
+# Upper bound of queued writes committed in one transaction
+DEFAULT_MAX_BATCH = 256
+
+class AsyncDatabaseManager:
+    """Runs DatabaseManager calls without blocking the event loop
+
+    Reads are spread over a pool of threads, each with its own connection.
+    The database is switched to WAL so readers do not wait for the writer.
+    Writes go through a queue to a single writer connection, everything
+    queued up while the previous batch ran is committed together.
+
+    Args:
+        db_name: database file, an in-memory database cannot be shared
+            between connections
+        readers: number of reader threads
+        max_batch: maximum number of writes per transaction
+    """
+    def __init__(self, db_name, readers=DEFAULT_READERS, max_batch=DEFAULT_MAX_BATCH):
+        if db_name == ":memory:":
+            raise ValueError("AsyncDatabaseManager needs a database file")
+        self.db_name = db_name
+        self.max_batch = max_batch
+        # WAL is persistent, every connection opened later uses it
+        db_manager = DatabaseManager(db_name)
+        db_manager.cursor.execute("PRAGMA journal_mode=WAL")
+        db_manager.close_connection()
+        self.batches = 0
+        self._local = threading.local()
+        self._reader_managers = []
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix="db-reader")
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+        self._writer_manager = None
+        self._queue = None
+        self._writer_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close_connection()
+
+    #################################################
+    def _reader(self):
+        """DatabaseManager of the current reader thread"""
+        db_manager = getattr(self._local, "db_manager", None)
+        if db_manager is None:
+            db_manager = DatabaseManager(self.db_name, check_same_thread=False)
+            db_manager.cursor.execute("PRAGMA query_only=ON")
+            self._local.db_manager = db_manager
+            self._reader_managers.append(db_manager)
+        return db_manager
+
+    def _run_read(self, method, args):
+        return method(self._reader(), *args)
+
+    async def _read(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, method, args)
+
+    #################################################
+    def _run_batch(self, batch):
+        """Runs a batch of writes in one transaction on the writer thread
+
+        Every write gets a savepoint so a failing one does not undo the
+        others.
+
+        Returns:
+            list of (result, exception)
+        """
+        if self._writer_manager is None:
+            self._writer_manager = DatabaseManager(self.db_name, check_same_thread=False)
+        db_manager = self._writer_manager
+
+        outcomes = []
+        with db_manager._deferred_commit():  # pylint: disable=protected-access
+            db_manager.cursor.execute("BEGIN")
+            for method, args, _ in batch:
+                db_manager.cursor.execute("SAVEPOINT write")
+                try:
+                    outcomes.append((method(db_manager, *args), None))
+                except Exception as error:  # pylint: disable=broad-except
+                    db_manager.cursor.execute("ROLLBACK TO write")
+                    outcomes.append((None, error))
+                db_manager.cursor.execute("RELEASE write")
+        db_manager.conn.commit()
+        return outcomes
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            stop = batch[-1] is None
+            batch = [job for job in batch if job is not None]
+            if batch:
+                try:
+                    outcomes = await loop.run_in_executor(self._writer, self._run_batch, batch)
+                except Exception as error:  # pylint: disable=broad-except
+                    outcomes = [(None, error)] * len(batch)
+                self.batches += 1
+                for (_, _, future), (result, error) in zip(batch, outcomes):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+            if stop:
+                return
+
+    async def _write(self, method, *args):
+        if self._writer_task is None:
+            self._queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._write_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((method, args, future))
+        return await future
+
+    #################################################
+    async def create_table(self, table_name, columns, indexes=None):
+        return await self._write(DatabaseManager.create_table, table_name, columns, indexes)
+
+    async def insert_data(self, table_name, data):
+        return await self._write(DatabaseManager.insert_data, table_name, data)
+
+    async def insert_data_unique(self, table_name, data):
+        return await self._write(DatabaseManager.insert_data_unique, table_name, data)
+
+    async def fetch_data(self, table_name):
+        return await self._read(DatabaseManager.fetch_data, table_name)
+
+    async def close_connection(self):
+        """Waits for the queued writes and closes every connection"""
+        if self._writer_task is not None:
+            await self._queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+        self._readers.shutdown()
+        self._writer.shutdown()
+        for db_manager in self._reader_managers:
+            db_manager.close_connection()
+        if self._writer_manager is not None:
+            self._writer_manager.close_connection()
@@ -0,0 +1,69 @@
+"""Unit test for the AsyncDatabaseManager"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from async_db import AsyncDatabaseManager
+
+class TestAsyncDatabaseManager(unittest.IsolatedAsyncioTestCase):
+    """TestAsyncDatabaseManager class"""
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.temp_dir.name, "test.db")
+        self.db_manager = AsyncDatabaseManager(self.db_name, readers=2)
+        self.table_name = "test_table"
+        await self.db_manager.create_table(self.table_name, [
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+
+    async def asyncTearDown(self):
+        await self.db_manager.close_connection()
+        self.temp_dir.cleanup()
+
+    def test_memory_database_rejected(self):
+        with self.assertRaises(ValueError):
+            AsyncDatabaseManager(":memory:")
+
+    async def test_wal_mode(self):
+        conn = sqlite3.connect(self.db_name)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        conn.close()
+
+    async def test_concurrent_inserts_are_batched(self):
+        batches = self.db_manager.batches
+        await asyncio.gather(*[
+            self.db_manager.insert_data(self.table_name, [(f"user{i}", f"user{i}@example.com")])
+            for i in range(50)
+        ])
+        result = await self.db_manager.fetch_data(self.table_name)
+        self.assertEqual(len(result), 50)
+        self.assertLess(self.db_manager.batches - batches, 50)
+
+    async def test_concurrent_readers(self):
+        await self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com")])
+        results = await asyncio.gather(*[self.db_manager.fetch_data(self.table_name)
+                                         for _ in range(10)])
+        for result in results:
+            self.assertEqual(result, [("Alice", "alice@example.com")])
+
+    async def test_failed_write_does_not_undo_batch(self):
+        results = await asyncio.gather(
+            self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com")]),
+            self.db_manager.insert_data("missing_table", [("Bob", "bob@example.com")]),
+            self.db_manager.insert_data_unique(self.table_name, [("Carol", "carol@example.com")]),
+            return_exceptions=True)
+        self.assertIsInstance(results[1], sqlite3.OperationalError)
+        result = await self.db_manager.fetch_data(self.table_name)
+        self.assertCountEqual(result, [("Alice", "alice@example.com"),
+                                       ("Carol", "carol@example.com")])
+
+    async def test_readers_cannot_write(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            await self.db_manager._read(lambda db_manager: db_manager.insert_data(
+                self.table_name, [("Alice", "alice@example.com")]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+"""Benchmarks for the encryption, the database operations and the CLI
+
+Generates synthetic databases of the requested sizes, measures them and
+writes the results as JSON. Given a baseline from an earlier run the
+results are compared against it and the exit status is 1 on a regression.
+
+    python benchmark.py --sizes 1MB,64MB,1GB --output results.json
+    python benchmark.py --baseline results.json
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from db import DatabaseManager
+from encrypt import DatabaseEncryptor
+
+DEFAULT_SIZES = "1MB,16MB"
+DEFAULT_BATCH_SIZES = "1,100,10000"
+# Rows inserted per batch size, fewer for batch size 1 that commits per row
+DEFAULT_INSERT_ROWS = 20000
+# Allowed slowdown against the baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.10
+CLI_RUNS = 5
+# Time python -X importtime may spend importing main, in milliseconds
+DEFAULT_STARTUP_BUDGET = 50.0
+TABLE_NAME = "users"
+COLUMNS = [
+    {"name": "id", "type": "INTEGER", "primary_key": True},
+    {"name": "name", "type": "TEXT", "not_null": True, "index": True},
+    {"name": "email", "type": "TEXT", "not_null": True, "unique": True}
+]
+UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "B": 1}
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+def parse_size(size):
+    """Turns 512KB, 16MB or 2GB into a number of bytes"""
+    size = size.strip().upper()
+    for unit, factor in UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+def metric(value, unit, better):
+    """A measurement, better is "higher" or "lower" """
+    return {"value": value, "unit": unit, "better": better}
+
+def peak_rss():
+    """Peak resident set size of this process in MB"""
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def rows(start, count):
+    return ((f"user{i}", f"user{i}@example.com") for i in range(start, start + count))
+
+def generate_database(db_name, size, batch=10000):
+    """Fills a database with synthetic users until it reaches size bytes
+
+    Returns:
+        number of rows
+    """
+    db_manager = DatabaseManager(db_name)
+    db_manager.create_table(TABLE_NAME, COLUMNS)
+    count = 0
+    while os.path.getsize(db_name) < size:
+        db_manager.insert_data(TABLE_NAME, rows(count, batch))
+        count += batch
+    db_manager.close_connection()
+    return count
+
+#################################################
+# Cases, each runs in a process of its own so peak_rss() is its own
+
+def bench_crypto(work_dir, size):
+    plain = os.path.join(work_dir, "crypto.db")
+    generate_database(plain, size)
+    size = os.path.getsize(plain)
+    encryptor = DatabaseEncryptor(os.urandom(32))
+    rss_before = peak_rss()
+
+    start = time.perf_counter()
+    encryptor.encrypt_file(plain, plain + ".enc")
+    encrypt_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    encryptor.decrypt_file(plain + ".enc", plain + ".dec")
+    decrypt_seconds = time.perf_counter() - start
+
+    megabytes = size / 1024 ** 2
+    return {
+        "encrypt": metric(megabytes / encrypt_seconds, "MB/s", "higher"),
+        "decrypt": metric(megabytes / decrypt_seconds, "MB/s", "higher"),
+        "crypto_peak_rss": metric(peak_rss(), "MB", "lower"),
+        "crypto_rss_growth": metric(peak_rss() - rss_before, "MB", "lower"),
+    }
+
+def bench_insert(work_dir, batch_size, total):
+    db_name = os.path.join(work_dir, f"insert{batch_size}.db")
+    db_manager = DatabaseManager(db_name)
+    db_manager.create_table(TABLE_NAME, COLUMNS)
+    total = max(batch_size, total if batch_size > 1 else min(total, 2000))
+    start = time.perf_counter()
+    for first in range(0, total, batch_size):
+        db_manager.insert_data(TABLE_NAME, rows(first, batch_size))
+    seconds = time.perf_counter() - start
+    db_manager.close_connection()
+    return {"insert": metric(total / seconds, "rows/s", "higher")}
+
+def bench_list(work_dir, size):
+    db_name = os.path.join(work_dir, "list.db")
+    count = generate_database(db_name, size)
+    db_manager = DatabaseManager(db_name)
+    start = time.perf_counter()
+    iterator = db_manager.iter_rows(TABLE_NAME)
+    next(iterator)
+    first_row = time.perf_counter() - start
+    for _ in iterator:
+        pass
+    seconds = time.perf_counter() - start
+    db_manager.close_connection()
+    return {
+        "list_first_row": metric(first_row * 1000, "ms", "lower"),
+        "list_all": metric(seconds * 1000, "ms", "lower"),
+        "list_rows_per_second": metric(count / seconds, "rows/s", "higher"),
+    }
+
+def bench_cli(work_dir):
+    config = {"encryption_key": base64.b64encode(os.urandom(32)).decode("utf-8"),
+              "database_name": "bench.db.enc", "table_name": TABLE_NAME,
+              "columns": COLUMNS, "emd5": "", "pmd5": ""}
+    with open(os.path.join(work_dir, "config.json"), "w", encoding="utf-8") as file:
+        json.dump(config, file)
+
+    def run(*args):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, MAIN, *args], cwd=work_dir, check=True,
+                       stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    run("--action", "add", "--name", "bench", "--email", "bench@example.com")
+    timings = {
+        "cli_list": [run("--action", "list") for _ in range(CLI_RUNS)],
+        "cli_add": [run("--action", "add", "--name", f"user{i}", "--email", f"user{i}@x")
+                    for i in range(CLI_RUNS)],
+        "cli_help": [run("--help") for _ in range(CLI_RUNS)],
+    }
+    return {name: metric(statistics.median(values) * 1000, "ms", "lower")
+            for name, values in timings.items()}
+
+def import_time(module, cwd=None):
+    """Cumulative import time of module in a fresh interpreter, in ms
+
+    Returns:
+        (milliseconds, names of the modules it imported)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=cwd or os.path.dirname(MAIN), check=True,
+                            capture_output=True, text=True)
+    # Lines read "import time: self [us] | cumulative | imported package"
+    entries = [line.split("|") for line in result.stderr.splitlines()
+               if line.startswith("import time:") and "|" in line and "[us]" not in line]
+    names = [entry[2].strip() for entry in entries]
+    cumulative = next(int(entry[1]) for entry in reversed(entries)
+                      if entry[2].strip() == module)
+    return cumulative / 1000, names
+
+def bench_startup(work_dir):
+    del work_dir
+    timings, _ = zip(*(import_time("main") for _ in range(CLI_RUNS)))
+    return {"startup_import": metric(statistics.median(timings), "ms", "lower")}
+
+def _run_case(case, *args):
+    work_dir = tempfile.mkdtemp(prefix="pydb-bench-")
+    try:
+        return case(work_dir, *args)
+    finally:
+        shutil.rmtree(work_dir)
+
+#################################################
+
+def run_benchmarks(sizes, batch_sizes, insert_rows=DEFAULT_INSERT_ROWS, cli=True):
+    """Runs every case, each in a fresh process
+
+    Returns:
+        dict of metric name to metric()
+    """
+    cases = []
+    for size in sizes:
+        label = f"[{size}]"
+        cases.append((label, bench_crypto, parse_size(size)))
+    for batch_size in batch_sizes:
+        cases.append((f"[batch={batch_size}]", bench_insert, batch_size, insert_rows))
+    cases.append((f"[{sizes[-1]}]", bench_list, parse_size(sizes[-1])))
+    if cli:
+        cases.append(("", bench_startup))
+        cases.append(("", bench_cli))
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for label, case, *args in cases:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            measured = executor.submit(_run_case, case, *args).result()
+        for name, value in measured.items():
+            results[name + label] = value
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares results with a baseline
+
+    Returns:
+        list of messages describing the regressions
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous["value"]:
+            continue
+        change = (current["value"] - previous["value"]) / previous["value"]
+        if current["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{name}: {current['value']:.2f} {current['unit']} against "
+                               f"{previous['value']:.2f}, {change:.0%} worse")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated database sizes, e.g. 1MB,64MB,2GB")
+    parser.add_argument("--batch-sizes", default=DEFAULT_BATCH_SIZES,
+                        help="comma separated insert batch sizes")
+    parser.add_argument("--insert-rows", type=int, default=DEFAULT_INSERT_ROWS)
+    parser.add_argument("--no-cli", action="store_true", help="skip the CLI runs")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--startup-budget", type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help="milliseconds importing main may take")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes.split(","),
+                             [int(size) for size in args.batch_sizes.split(",")],
+                             args.insert_rows, cli=not args.no_cli)
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "results": results}
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output)
+    print(output)
+
+    regressions = []
+    startup = results.get("startup_import")
+    if startup and startup["value"] > args.startup_budget:
+        regressions.append(f"startup_import: {startup['value']:.2f} ms over the budget of "
+                           f"{args.startup_budget:.2f} ms")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions += compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Unit test for the benchmark helpers"""
+import os
+import tempfile
+import unittest
+
+from benchmark import (parse_size, metric, compare, generate_database, bench_insert,
+                       import_time)
+
+class TestBenchmark(unittest.TestCase):
+    """TestBenchmark class"""
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512KB"), 512 * 1024)
+        self.assertEqual(parse_size("1.5mb"), 3 * 512 * 1024)
+        self.assertEqual(parse_size("2GB"), 2 * 1024 ** 3)
+        self.assertEqual(parse_size("100"), 100)
+
+    def test_compare(self):
+        baseline = {"encrypt": metric(100.0, "MB/s", "higher"),
+                    "cli_list": metric(100.0, "ms", "lower"),
+                    "insert": metric(100.0, "rows/s", "higher")}
+        results = {"encrypt": metric(80.0, "MB/s", "higher"),
+                   "cli_list": metric(105.0, "ms", "lower"),
+                   "insert": metric(150.0, "rows/s", "higher"),
+                   "new_metric": metric(1.0, "ms", "lower")}
+        regressions = compare(results, baseline, tolerance=0.1)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("encrypt:"))
+        self.assertEqual(len(compare({"cli_list": metric(120.0, "ms", "lower")}, baseline)), 1)
+
+    def test_cases(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            db_name = os.path.join(work_dir, "test.db")
+            self.assertGreater(generate_database(db_name, 64 * 1024, batch=500), 0)
+            self.assertGreaterEqual(os.path.getsize(db_name), 64 * 1024)
+            result = bench_insert(work_dir, 10, 100)
+            self.assertGreater(result["insert"]["value"], 0)
+
+    def test_startup_imports(self):
+        milliseconds, modules = import_time("main")
+        self.assertGreater(milliseconds, 0)
+        self.assertIn("argparse", modules)
+        for heavy in ("Crypto.Cipher.AES", "sqlite3", "session", "server", "log"):
+            self.assertNotIn(heavy, modules)
+
+if __name__ == '__main__':
+    unittest.main()
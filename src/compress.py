@@ -0,0 +1,92 @@
+"""Compression applied to the plain text before it is encrypted
+
+A compressed stream starts with a 16 byte header, one AES block, naming
+the codec. SQLite files start with "SQLite format 3", so files written
+without compression are told apart by the header alone.
+"""
+import bz2
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"PYDBZ1"
+HEADER_SIZE = 16
+# Bytes fed to the compressor at a time when the input is one large buffer
+FEED_SIZE = 1024 * 1024
+
+CODECS = {
+    "zlib": (lambda: zlib.compressobj(6), zlib.decompressobj),
+    "lzma": (lzma.LZMACompressor, lzma.LZMADecompressor),
+    "bz2": (bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+if zstandard is not None:
+    CODECS["zstd"] = (lambda: zstandard.ZstdCompressor().compressobj(),
+                      lambda: zstandard.ZstdDecompressor().decompressobj())
+
+def check_codec(codec):
+    """Raises ValueError for a codec that is not available"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression {codec!r}, available: {', '.join(CODECS)}")
+    return codec
+
+def header(codec):
+    """Header announcing a stream compressed with codec"""
+    return (MAGIC + codec.encode('ascii')).ljust(HEADER_SIZE, b'\0')
+
+def header_codec(data):
+    """Returns the codec named by a header at the start of data, None when
+    data is not compressed"""
+    if len(data) < HEADER_SIZE or not data.startswith(MAGIC):
+        return None
+    return check_codec(bytes(data[len(MAGIC):HEADER_SIZE]).rstrip(b'\0').decode('ascii'))
+
+def compress_chunks(chunks, codec):
+    """Yields the header and the compressed stream of chunks"""
+    compressor = CODECS[codec][0]()
+    yield header(codec)
+    for chunk in chunks:
+        for offset in range(0, len(chunk), FEED_SIZE):
+            data = compressor.compress(chunk[offset:offset + FEED_SIZE])
+            if data:
+                yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+def decompress_chunks(chunks):
+    """Yields the decompressed stream of chunks, passing them through
+    unchanged when they do not start with a header"""
+    chunks = iter(chunks)
+    start = b''
+    for chunk in chunks:
+        start += chunk
+        if len(start) >= HEADER_SIZE:
+            break
+    codec = header_codec(start)
+    if codec is None:
+        if start:
+            yield start
+        yield from chunks
+        return
+
+    decompressor = CODECS[codec][1]()
+    data = decompressor.decompress(start[HEADER_SIZE:])
+    if data:
+        yield data
+    for chunk in chunks:
+        # lzma and bz2 refuse any call after the end of the stream, even
+        # an empty one as the final unpadded block can be
+        if not len(chunk):
+            continue
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    flush = getattr(decompressor, "flush", None)
+    if flush:
+        data = flush()
+        if data:
+            yield data
@@ -0,0 +1,32 @@
+"""Unit test for the compression stage"""
+import unittest
+
+from compress import (CODECS, HEADER_SIZE, check_codec, compress_chunks, decompress_chunks,
+                      header, header_codec)
+
+class TestCompression(unittest.TestCase):
+    """TestCompression class"""
+    def test_header(self):
+        self.assertEqual(len(header("zlib")), HEADER_SIZE)
+        self.assertEqual(header_codec(header("lzma") + b"data"), "lzma")
+        self.assertIsNone(header_codec(b"SQLite format 3\0"))
+        self.assertIsNone(header_codec(b"short"))
+        with self.assertRaises(ValueError):
+            check_codec("rar")
+
+    def test_round_trip(self):
+        data = b"".join(f"user{i},user{i}@example.com\n".encode() for i in range(5000))
+        for codec in CODECS:
+            compressed = b"".join(compress_chunks([data[:1000], data[1000:]], codec))
+            self.assertLess(len(compressed), len(data) // 2)
+            # Split at odd places, also inside the header
+            pieces = [compressed[:5], compressed[5:40], compressed[40:], b""]
+            self.assertEqual(b"".join(decompress_chunks(pieces)), data, codec)
+
+    def test_uncompressed_passes_through(self):
+        pieces = [b"SQLite", b" format 3\0", b"rest"]
+        self.assertEqual(b"".join(decompress_chunks(pieces)), b"".join(pieces))
+        self.assertEqual(list(decompress_chunks([])), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,70 @@
 import json
+import os
+import tempfile
+
+# Parsed config files by absolute path, reused while the file is unchanged
+_CACHE = {}
+_MISSING = object()
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+def _load(path):
+    """Returns the cache entry of path, parsing the file only when its
+    mtime, size or inode changed since it was last read"""
+    key = _stat_key(path)
+    entry = _CACHE.get(path)
+    if entry is None or entry["key"] != key:
+        with open(path, encoding='utf-8') as file:
+            entry = {"key": key, "data": json.load(file), "derived": {}}
+        _CACHE[path] = entry
+    return entry
 
 class TableConfig:
-    """Class to encapsulate the config.json capability"""
+    """Class to encapsulate the config.json capability
+
+    Parsed files are cached by path and modification time, so creating a
+    TableConfig for an unchanged file does not read it again. Changes made
+    with set() are tracked and overwrite() only writes when there are any.
+    """
 
     config_file = "config.json"
 
     def __init__(self, config_file):
         self.config_file = config_file
-        with open(config_file,encoding='utf-8') as file:
-            self.config_data = json.load(file)
+        self._path = os.path.abspath(config_file)
+        self.dirty = set()
+        self._entry = _load(self._path)
+        # set() replaces top level keys only, the values stay shared
+        self.config_data = dict(self._entry["data"])
+
+    def reload(self):
+        """Picks up changes made to the file by others, keeping the values
+        set here and not written yet
+
+        Returns:
+            True when the file had changed
+        """
+        entry = _load(self._path)
+        if entry is self._entry:
+            return False
+        self._entry = entry
+        changes = {name: self.config_data[name] for name in self.dirty}
+        self.config_data = dict(entry["data"])
+        self.config_data.update(changes)
+        return True
+
+    def derived(self, name, build):
+        """Returns build(), computed once per version of the file
+
+        For values derived from the file alone, such as the DDL of the
+        table, build must not depend on keys changed with set().
+        """
+        derived = self._entry["derived"]
+        if name not in derived:
+            derived[name] = build()
+        return derived[name]
 
     def get_table_name(self):
         return self.config_data["table_name"]
@@ -16,6 +72,30 @@ class TableConfig:
     def get_columns(self):
         return self.config_data["columns"]
 
+    def get_column_names(self):
+        """Returns the column names, a column is either a definition or a
+        plain name
+
+        Raises:
+            ValueError: a column definition has no name
+        """
+        if "columns" in self.dirty:
+            return self._column_names(self.config_data["columns"])
+        return self.derived("column_names", lambda: self._column_names(self.config_data["columns"]))
+
+    @staticmethod
+    def _column_names(columns):
+        names = []
+        for column in columns:
+            name = column.get("name") if isinstance(column, dict) else column
+            if not name or not isinstance(name, str):
+                raise ValueError(f"Column needs a name: {column!r}")
+            names.append(name)
+        return tuple(names)
+
+    def get_indexes(self):
+        return self.config_data.get("indexes", [])
+
     def get(self, name):
         try:
             return self.config_data[name]
@@ -23,8 +103,90 @@ class TableConfig:
             return ""
 
     def set(self, name, value):
-        self.config_data[name]=value
+        if self.config_data.get(name, _MISSING) != value:
+            self.config_data[name] = value
+            self.dirty.add(name)
+
+    def overwrite(self):
+        """Writes the changed keys back to the file
+
+        The file is re-read first when someone else changed it, then
+        replaced in one step by a fully written temporary file, so it is
+        never left half written.
+
+        Returns:
+            False when there was nothing to write
+        """
+        if not self.dirty:
+            return False
+        self.reload()
+        directory = os.path.dirname(self._path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as config_file:
+                json.dump(self.config_data, config_file, indent=4)
+                config_file.flush()
+                os.fsync(config_file.fileno())
+            os.chmod(temp_path, os.stat(self._path).st_mode & 0o7777)
+            os.replace(temp_path, self._path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.dirty.clear()
+        # What was just written is what the next reader would parse
+        self._entry = {"key": _stat_key(self._path), "data": dict(self.config_data),
+                       "derived": {}}
+        _CACHE[self._path] = self._entry
+        return True
+
+    def get_shards(self):
+        """Returns a ShardConfig for each entry of "shards", an empty list
+        when the table is not sharded"""
+        return [ShardConfig(self, index) for index in range(len(self.get("shards") or []))]
+
+class ShardConfig:
+    """Settings of one shard, an entry of the "shards" list of config.json
+
+    An entry names the database file and the table of the shard. Keys it
+    does not set, the columns for instance, are read from the top level.
+    Values set on it, such as the checksums of its database, are stored
+    in the entry.
+    """
+    def __init__(self, table_config, index):
+        self.table_config = table_config
+        self.index = index
+
+    def _entry(self):
+        return self.table_config.config_data["shards"][self.index]
+
+    def get_table_name(self):
+        return self.get("table_name")
+
+    def get_columns(self):
+        return self.get("columns")
+
+    def get_indexes(self):
+        return self.get("indexes") or []
+
+    def derived(self, name, build):
+        """See TableConfig.derived(), kept apart for each shard"""
+        return self.table_config.derived((name, self.index), build)
+
+    def get(self, name):
+        entry = self._entry()
+        if name in entry:
+            return entry[name]
+        return self.table_config.get(name)
+
+    def set(self, name, value):
+        # The entries are shared with the cache, they are copied, not changed
+        shards = [dict(entry) for entry in self.table_config.config_data["shards"]]
+        shards[self.index][name] = value
+        self.table_config.set("shards", shards)
+
+    def reload(self):
+        return self.table_config.reload()
 
     def overwrite(self):
-        with open(self.config_file, 'w', encoding='utf-8') as config_file:
-            json.dump(self.config_data, config_file, indent=4)
+        return self.table_config.overwrite()
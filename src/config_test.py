@@ -2,6 +2,7 @@
 import unittest
 import json
 import os
+import config
 from config import TableConfig
 
 class TestTableConfig(unittest.TestCase):
@@ -58,5 +59,57 @@ class TestTableConfig(unittest.TestCase):
         print(f"{updated_data} : {new_config_data}")
         self.assertEqual(updated_data, new_config_data)
 
+    def test_overwrite_skips_unchanged(self):
+        mtime = os.stat(self.config_file).st_mtime_ns
+        self.table_config.set("table_name", "users")
+        self.assertFalse(self.table_config.overwrite())
+        self.assertEqual(os.stat(self.config_file).st_mtime_ns, mtime)
+
+    def test_overwrite_leaves_no_temporary_file(self):
+        self.table_config.set("emd5", "abc")
+        self.assertTrue(self.table_config.overwrite())
+        self.assertFalse(self.table_config.dirty)
+        self.assertEqual([name for name in os.listdir(".") if name.endswith(".tmp")], [])
+
+    def test_overwrite_keeps_changes_made_by_others(self):
+        other = TableConfig(self.config_file)
+        other.set("pmd5", "123")
+        other.overwrite()
+        self.table_config.set("emd5", "abc")
+        self.table_config.overwrite()
+        with open(self.config_file, encoding='utf-8') as file:
+            written = json.load(file)
+        self.assertEqual((written["emd5"], written["pmd5"]), ("abc", "123"))
+
+    def test_parsed_file_is_cached(self):
+        entry = config._CACHE[os.path.abspath(self.config_file)]
+        again = TableConfig(self.config_file)
+        self.assertIs(again._entry, entry)
+        self.assertEqual(again.derived("answer", lambda: 42), 42)
+        self.assertEqual(self.table_config.derived("answer", lambda: 0), 42)
+
+    def test_get_column_names(self):
+        self.assertEqual(self.table_config.get_column_names(), ("id", "name", "email"))
+        self.table_config.set("columns", [{"name": "id", "type": "INTEGER"}, "email"])
+        self.assertEqual(self.table_config.get_column_names(), ("id", "email"))
+        self.table_config.set("columns", [{"type": "TEXT"}])
+        with self.assertRaises(ValueError):
+            self.table_config.get_column_names()
+
+    def test_shards(self):
+        self.assertEqual(self.table_config.get_shards(), [])
+        self.table_config.set("shards", [{"database_name": "a.db.enc", "table_name": "users_a"},
+                                         {"database_name": "b.db.enc", "table_name": "users_b"}])
+        shards = self.table_config.get_shards()
+        self.assertEqual(shards[1].get_table_name(), "users_b")
+        # Keys missing from an entry come from the top level
+        self.assertEqual(shards[1].get("primary_key"), "id")
+        shards[1].set("emd5", "abc")
+        self.assertEqual(shards[1].get("emd5"), "abc")
+        self.assertEqual(shards[0].get("emd5"), "")
+        shards[1].overwrite()
+        with open(self.config_file, encoding='utf-8') as file:
+            self.assertEqual(json.load(file)["shards"][1]["emd5"], "abc")
+
 if __name__ == '__main__':
     unittest.main()
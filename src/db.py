@@ -1,15 +1,339 @@
 """Database Manager class """
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import timed
+from records import Columns, record_class
+
+# Rows a WriteBuffer holds before it commits them
+DEFAULT_BUFFER_ROWS = 10000
+# Seconds a buffered row may wait for its commit
+DEFAULT_BUFFER_SECONDS = 1.0
+# Rows fetched from sqlite at a time when iterating
+DEFAULT_FETCH_SIZE = 1000
+# Rows per keyset query when paging through a table
+DEFAULT_PAGE_SIZE = 500
+# Name prefix of the indexes generated from the config
+INDEX_PREFIX = "idx_"
+# Keys deleted with an IN list, larger sets go through a temp table
+MAX_IN_LIST = 500
+# Prepared statements sqlite keeps per connection, the default is 128
+DEFAULT_CACHED_STATEMENTS = 512
+# Memory the cached query results may take, estimated
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+# Seconds a cached query result is used for
+DEFAULT_CACHE_TTL = 60.0
+# Columns written by the insert methods for tables not created or registered
+DEFAULT_COLUMNS = ("name", "email")
+
+def check_identifier(name):
+    """Raises ValueError unless name can be used as a table or column name,
+    optionally qualified by a schema name"""
+    if not all(part.isidentifier() for part in str(name).split(".", 1)):
+        raise ValueError(f"Invalid table or column name {name!r}")
+    return name
+
+def result_size(rows):
+    """Estimated memory taken by a list of rows, in bytes"""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+class ResultCache:
+    """LRU cache of query results, bounded in memory and in age
+
+    Results are keyed by table, query and parameters. A write to a table
+    drops its results, and a result read while the table was being
+    written is not stored. Share one cache between the DatabaseManagers of
+    a database so the writes of each invalidate the results of all.
+
+    Args:
+        max_bytes: estimated memory the results may take
+        ttl: seconds a result is used for, None for no limit
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, ttl=DEFAULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expiry, size, rows), least recently used first
+        self._entries = OrderedDict()
+        self._tables = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, table_name):
+        """Counter changed by every invalidation of the table, pass it to
+        put() to drop a result the table changed under"""
+        with self._lock:
+            return self._generations.get(table_name, 0)
+
+    def get(self, key):
+        """Returns the cached rows of key, None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, rows, generation):
+        """Stores rows for key, a (table, query, parameters) tuple, unless
+        the table was invalidated since generation()"""
+        size = result_size(rows)
+        if size > self.max_bytes:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        table_name = key[0]
+        with self._lock:
+            if self._generations.get(table_name, 0) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expiry, size, rows)
+            self._tables.setdefault(table_name, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+        keys = self._tables[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._tables[key[0]]
+
+    def invalidate(self, table_name):
+        """Drops the results read from the table"""
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            for key in list(self._tables.get(table_name, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for table_name in list(self._tables):
+                self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            self._entries.clear()
+            self._tables.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns the hits, misses, hit rate and size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "entries": len(self._entries),
+                    "bytes": self.bytes}
 
 class DatabaseManager:
-    def __init__(self, db_name):
-        self.conn = sqlite3.connect(db_name)
+    """Runs the table operations on one sqlite connection
+
+    Args:
+        db_name: database file, or :memory:
+        check_same_thread: see sqlite3.connect()
+        cached_statements: prepared statements sqlite keeps
+        result_cache: ResultCache for the results of fetch_data() and
+            fetch_page(), None to always query
+    """
+    def __init__(self, db_name, check_same_thread=True,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, result_cache=None):
+        self.conn = sqlite3.connect(db_name, check_same_thread=check_same_thread,
+                                    cached_statements=cached_statements)
         self.cursor = self.conn.cursor()
+        # While positive the methods leave committing to the caller
+        self._commit_deferred = 0
+        # SQL built by the methods, keyed by (operation, table, variant...)
+        self._statements = {}
+        self.statement_hits = 0
+        self.statement_misses = 0
+        # (all columns, inserted columns, types) of the tables whose config is known
+        self._tables = {}
+        self._record_classes = {}
+        self.result_cache = result_cache
+        # Tables written since the last commit, invalidated again once it
+        # is committed or rolled back
+        self._written = set()
+
+    def _statement(self, key, build):
+        """Returns the SQL for key, building it with build() the first time
+
+        The table name, key[1], is checked once when the SQL is built.
+        Reusing the same string also lets sqlite reuse its prepared
+        statement.
+        """
+        try:
+            statement = self._statements[key]
+        except KeyError:
+            check_identifier(key[1])
+            statement = self._statements[key] = build()
+            self.statement_misses += 1
+            return statement
+        self.statement_hits += 1
+        return statement
+
+    def statement_stats(self):
+        """Returns the hits and misses of the statement registry"""
+        return {"hits": self.statement_hits, "misses": self.statement_misses,
+                "statements": len(self._statements)}
+
+    def _commit(self):
+        if not self._commit_deferred:
+            self.conn.commit()
+            self._invalidate_written()
+
+    def _write(self, table_name):
+        """Drops the cached results of a table about to be written"""
+        if self.result_cache is not None:
+            self.result_cache.invalidate(table_name)
+            self._written.add(table_name)
+
+    def _invalidate_written(self):
+        # Other connections may have cached what they read before the commit
+        for table_name in self._written:
+            self.result_cache.invalidate(table_name)
+        self._written.clear()
+
+    def _cached_query(self, table_name, query, params=()):
+        """Runs a query returning rows, through the result cache"""
+        if self.result_cache is None:
+            cursor = self.conn.execute(query, params)
+            try:
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        key = (table_name, query, tuple(params))
+        rows = self.result_cache.get(key)
+        if rows is None:
+            generation = self.result_cache.generation(table_name)
+            cursor = self.conn.execute(query, params)
+            try:
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+            if not self._written:
+                self.result_cache.put(key, rows, generation)
+        return list(rows)
 
-    def create_table(self, table_name, columns):
-        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ("
+    def cache_stats(self):
+        """Returns the result cache statistics, None without a cache"""
+        return self.result_cache.stats() if self.result_cache is not None else None
+
+    @contextmanager
+    def _deferred_commit(self):
+        """Makes the methods skip their commit, the caller commits"""
+        self._commit_deferred += 1
+        try:
+            yield self
+        finally:
+            self._commit_deferred -= 1
+
+    @contextmanager
+    def transaction(self):
+        """Groups the calls made inside into a single commit
+
+        Rolls back when the block raises. Nested blocks join the outer
+        transaction, only the outermost one commits.
+        """
+        with self._deferred_commit():
+            try:
+                yield self
+            except BaseException:
+                if self._commit_deferred == 1:
+                    self.conn.rollback()
+                    self._invalidate_written()
+                raise
+        self._commit()
+
+    def write_buffer(self, table_name, max_rows=DEFAULT_BUFFER_ROWS,
+                     max_seconds=DEFAULT_BUFFER_SECONDS, unique=True):
+        """Returns a WriteBuffer committing into table_name"""
+        return WriteBuffer(self, table_name, max_rows, max_seconds, unique)
+
+    def register_table(self, table_name, columns):
+        """Tells the methods the columns of an existing table
+
+        The statements are then generated from these columns instead of
+        assuming (name, email). An INTEGER PRIMARY KEY column is an alias
+        of the rowid, sqlite assigns it and it is not inserted.
+
+        Args:
+            columns: column definitions from config.json
+        """
+        names = tuple(check_identifier(column["name"]) for column in columns)
+        inserted = tuple(column["name"] for column in columns
+                         if not (column.get("primary_key")
+                                 and column.get("type", "").upper() == "INTEGER"))
+        types = tuple(column.get("type", "") for column in columns)
+        self._tables[check_identifier(table_name)] = (names, inserted, types)
+        for key in [key for key in self._statements if key[1] == table_name]:
+            del self._statements[key]
+        self._record_classes.pop(table_name, None)
+
+    def data_columns(self, table_name):
+        """Returns the columns the insert methods expect, in row order"""
+        return self._tables.get(table_name, (None, DEFAULT_COLUMNS))[1]
+
+    def column_names(self, table_name):
+        """Returns every column of the table"""
+        return self.table_info(table_name)[0]
+
+    def table_info(self, table_name):
+        """Returns the names and the declared types of every column"""
+        if table_name in self._tables:
+            names, _, types = self._tables[table_name]
+            return names, types
+        cursor = self.conn.execute(f"PRAGMA table_info({check_identifier(table_name)})")
+        try:
+            info = cursor.fetchall()
+        finally:
+            cursor.close()
+        return tuple(row[1] for row in info), tuple(row[2] for row in info)
+
+    def record_class(self, table_name):
+        """Returns the Record class of the table's rows, see records.py"""
+        if table_name not in self._record_classes:
+            self._record_classes[table_name] = record_class(table_name,
+                                                            self.column_names(table_name))
+        return self._record_classes[table_name]
+
+    def _projection(self, table_name):
+        if table_name in self._tables:
+            return ", ".join(self._tables[table_name][0])
+        return "*"
+
+    def _placeholders(self, table_name):
+        columns = self.data_columns(table_name)
+        return f"({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    @timed("db.create_table")
+    def create_table(self, table_name, columns, indexes=None):
+        """Creates the table and the indexes declared for it
+
+        Args:
+            table_name: table to create
+            columns: column definitions from config.json, a column with
+                "index" set gets an index of its own
+            indexes: table level index definitions, see index_statements()
+        """
+        create_table_query = f"CREATE TABLE IF NOT EXISTS {check_identifier(table_name)} ("
         for column in columns:
-            column_name = column["name"]
+            column_name = check_identifier(column["name"])
             column_type = column["type"]
             create_table_query += f"{column_name} {column_type}"
 
@@ -25,21 +349,422 @@ class DatabaseManager:
             create_table_query += ","
         create_table_query = create_table_query.rstrip(",") + ")"
         self.cursor.execute(create_table_query)
-        self.conn.commit()
+        self.register_table(table_name, columns)
+        self.create_indexes(table_name, columns, indexes)
+        self._commit()
+
+    @staticmethod
+    def index_statements(table_name, columns, indexes=None):
+        """Builds the CREATE INDEX statements declared in the config
+
+        A column with "index": true gets a single column index. Entries of
+        indexes take "columns" (composite when more than one), optional
+        "include" columns appended so the index covers the query, "unique",
+        a "where" clause for a partial index and a "name".
+
+        Returns:
+            dict of index name to statement
+        """
+        definitions = [{"columns": [column["name"]]} for column in columns
+                       if column.get("index")]
+        definitions += indexes or []
+        statements = {}
+        for index in definitions:
+            index_columns = list(index["columns"]) + list(index.get("include", []))
+            for column in index_columns:
+                check_identifier(column)
+            name = index.get("name") or f"{INDEX_PREFIX}{table_name}_" + "_".join(index_columns)
+            statement = "CREATE UNIQUE INDEX" if index.get("unique") else "CREATE INDEX"
+            statement += f" {name} ON {table_name} ({', '.join(index_columns)})"
+            if index.get("where"):
+                statement += f" WHERE {index['where']}"
+            statements[name] = statement
+        return statements
+
+    @timed("db.create_indexes")
+    def create_indexes(self, table_name, columns, indexes=None, wanted=None):
+        """Brings the indexes of an existing table in line with the config
+
+        Missing indexes are created and changed ones rebuilt. Generated
+        indexes that are no longer declared are dropped, indexes created
+        by other means are left alone.
+
+        Args:
+            wanted: index_statements() computed earlier, built from
+                columns and indexes when None
+
+        Returns:
+            number of indexes created or dropped
+        """
+        if wanted is None:
+            wanted = self.index_statements(table_name, columns, indexes)
+        self.cursor.execute("SELECT name, sql FROM sqlite_master "
+                            "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                            (table_name,))
+        existing = dict(self.cursor.fetchall())
+        changes = 0
+        for name, statement in existing.items():
+            stale = name in wanted and wanted[name] != statement
+            dropped = name not in wanted and name.startswith(f"{INDEX_PREFIX}{table_name}_")
+            if stale or dropped:
+                self.cursor.execute(f"DROP INDEX {name}")
+                changes += 1
+        for name, statement in wanted.items():
+            if existing.get(name) != statement:
+                self.cursor.execute(statement)
+                changes += 1
+        if changes:
+            self._commit()
+        return changes
 
+    @timed("db.insert_data")
     def insert_data(self, table_name, data):
-        insert_query = f"INSERT INTO {table_name} (name, email) VALUES (?, ?)"
+        insert_query = self._statement(
+            ("insert", table_name),
+            lambda: f"INSERT INTO {table_name} {self._placeholders(table_name)}")
+        self._write(table_name)
         self.cursor.executemany(insert_query, data)
-        self.conn.commit()
+        self._commit()
 
+    @timed("db.insert_data_unique")
     def insert_data_unique(self, table_name, data):
-        insert_query = f"INSERT OR REPLACE INTO {table_name} (name, email) VALUES (?, ?)"
+        insert_query = self._statement(
+            ("insert_unique", table_name),
+            lambda: f"INSERT OR REPLACE INTO {table_name} {self._placeholders(table_name)}")
+        self._write(table_name)
         self.cursor.executemany(insert_query, data)
-        self.conn.commit()
+        self._commit()
 
+    @timed("db.upsert")
+    def upsert(self, table_name, data, key="email"):
+        """Inserts the rows, updating the other columns of existing ones
+
+        Unlike INSERT OR REPLACE the existing row is updated in place, it
+        keeps its rowid and the indexes are not rewritten for it. The key
+        column needs a UNIQUE constraint.
+
+        Returns:
+            number of rows inserted or updated
+        """
+        upsert_query = self._statement(
+            ("upsert", table_name, key),
+            lambda: self._upsert_query(table_name, key, None))
+        self._write(table_name)
+        self.cursor.executemany(upsert_query, data)
+        self._commit()
+        return self.cursor.rowcount
+
+    @timed("db.upsert_from")
+    def upsert_from(self, table_name, source_table, key="email"):
+        """Upserts every row of source_table, which has the same columns,
+        see upsert()
+
+        Returns:
+            number of rows inserted or updated
+        """
+        check_identifier(source_table)
+        self._write(table_name)
+        self.cursor.execute(self._statement(
+            ("upsert_from", table_name, key, source_table),
+            lambda: self._upsert_query(table_name, key, source_table)))
+        self._commit()
+        return self.cursor.rowcount
+
+    def _upsert_query(self, table_name, key, source_table):
+        check_identifier(key)
+        columns = self.data_columns(table_name)
+        if source_table:
+            # WHERE true keeps ON CONFLICT from being parsed as a join constraint
+            source = f"SELECT {', '.join(columns)} FROM {source_table} WHERE true"
+        else:
+            source = f"VALUES ({', '.join('?' * len(columns))})"
+        updates = [f"{column} = excluded.{column}" for column in columns if column != key]
+        action = "DO UPDATE SET " + ", ".join(updates) if updates else "DO NOTHING"
+        return (f"INSERT INTO {table_name} ({', '.join(columns)}) {source} "
+                f"ON CONFLICT({key}) {action}")
+
+    @timed("db.delete_many")
+    def delete_many(self, table_name, emails):
+        """Deletes the records with these emails in one statement
+
+        Small lists are matched with an IN list, anything else, including
+        iterators, is loaded into a temp table first.
+
+        Returns:
+            number of rows deleted
+        """
+        if isinstance(emails, (list, tuple, set)) and len(emails) <= MAX_IN_LIST:
+            if not emails:
+                return 0
+            placeholders = ", ".join("?" * len(emails))
+            delete_query = self._statement(
+                ("delete_in", table_name, len(emails)),
+                lambda: f"DELETE FROM {table_name} WHERE email IN ({placeholders})")
+            self._write(table_name)
+            self.cursor.execute(delete_query, list(emails))
+            deleted = self.cursor.rowcount
+            self._commit()
+            return deleted
+
+        with self.transaction():
+            self._write(table_name)
+            self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS delete_keys "
+                                "(email TEXT PRIMARY KEY)")
+            self.cursor.executemany("INSERT OR IGNORE INTO temp.delete_keys VALUES (?)",
+                                    ((email,) for email in emails))
+            self.cursor.execute(self._statement(
+                ("delete_keys", table_name),
+                lambda: f"DELETE FROM {table_name} "
+                        "WHERE email IN (SELECT email FROM temp.delete_keys)"))
+            deleted = self.cursor.rowcount
+            self.cursor.execute("DELETE FROM temp.delete_keys")
+        return deleted
+
+    @timed("db.delete_all")
+    def delete_all(self, table_name):
+        """Deletes every record
+
+        Returns:
+            number of rows deleted
+        """
+        self._write(table_name)
+        self.cursor.execute(self._statement(("delete_all", table_name),
+                                            lambda: f"DELETE FROM {table_name}"))
+        deleted = self.cursor.rowcount
+        self._commit()
+        return deleted
+
+    @timed("db.fetch_data")
     def fetch_data(self, table_name):
-        self.cursor.execute(f"SELECT * FROM {table_name}")
-        return self.cursor.fetchall()
+        return self._cached_query(table_name, self._statement(
+            ("select", table_name), lambda: self._select_query(table_name)))
+
+    def _select_query(self, table_name):
+        return f"SELECT {self._projection(table_name)} FROM {table_name}"
+
+    def iter_data(self, table_name, fetch_size=DEFAULT_FETCH_SIZE):
+        """Reads the table in batches of fetch_size rows
+
+        Returns:
+            (column names, generator of rows)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(self._statement(("select", table_name),
+                                       lambda: self._select_query(table_name)))
+        columns = [description[0] for description in cursor.description]
+
+        def rows():
+            try:
+                while True:
+                    batch = cursor.fetchmany(fetch_size)
+                    if not batch:
+                        return
+                    yield from batch
+            finally:
+                cursor.close()
+        return columns, rows()
+
+    @timed("db.fetch_page")
+    def fetch_page(self, table_name, page_size=DEFAULT_PAGE_SIZE, after=None, columns=None,
+                   name_prefix=None, email_prefix=None):
+        """Reads one page of rows in rowid order
+
+        Pages are found with WHERE rowid > after instead of OFFSET, so
+        reading a page costs the same wherever it is in the table. The
+        rowid is the id column of tables with an INTEGER PRIMARY KEY.
+
+        Args:
+            table_name: table to read
+            page_size: maximum number of rows
+            after: rowid of the last row of the previous page
+            columns: names of the columns to return, all by default
+            name_prefix: only rows whose name starts with it
+            email_prefix: only rows whose email starts with it
+
+        Returns:
+            (rows, rowid of the last row or None when there are no rows)
+        """
+        columns = tuple(columns) if columns else None
+        params = []
+        if after is not None:
+            params.append(after)
+        prefixes = (("name", name_prefix), ("email", email_prefix))
+        for _, prefix in prefixes:
+            if prefix:
+                params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        params.append(page_size)
+
+        def build():
+            projection = self._projection(table_name)
+            if columns:
+                projection = ", ".join(check_identifier(column) for column in columns)
+            conditions = []
+            if after is not None:
+                conditions.append("rowid > ?")
+            for column, prefix in prefixes:
+                if prefix:
+                    # A range instead of LIKE so an index on the column can be used
+                    conditions.append(f"{column} >= ? AND {column} < ?")
+            query = f"SELECT rowid, {projection} FROM {table_name}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            return query + " ORDER BY rowid LIMIT ?"
+
+        query = self._statement(("page", table_name, columns, after is not None,
+                                 bool(name_prefix), bool(email_prefix)), build)
+        rows = self._cached_query(table_name, query, params)
+        if not rows:
+            return [], None
+        return [row[1:] for row in rows], rows[-1][0]
+
+    def iter_rows(self, table_name, limit=None, page_size=DEFAULT_PAGE_SIZE, after=None,
+                  **query):
+        """Yields the rows page by page, see fetch_page() for the arguments
+
+        Only one page is held in memory and no read transaction stays open
+        between pages.
+
+        Args:
+            limit: stop after this many rows, all rows by default
+        """
+        while limit is None or limit > 0:
+            size = page_size if limit is None else min(page_size, limit)
+            rows, after = self.fetch_page(table_name, size, after, **query)
+            yield from rows
+            if len(rows) < size:
+                return
+            if limit is not None:
+                limit -= len(rows)
+
+    def iter_records(self, table_name, **query):
+        """Yields the rows as Record instances, see iter_rows() for the
+        arguments apart from columns"""
+        record = self.record_class(table_name)
+        for row in self.iter_rows(table_name, **query):
+            yield record(*row)
+
+    @timed("db.fetch_columns")
+    def fetch_columns(self, table_name, use_numpy=None, page_size=DEFAULT_FETCH_SIZE,
+                      **query):
+        """Reads the rows column by column, see iter_rows() for the
+        arguments apart from columns
+
+        Integer and real columns come back as arrays, no Python object is
+        kept per value.
+
+        Args:
+            use_numpy: numpy arrays, by default when numpy is installed
+
+        Returns:
+            dict of column name to array.array, list or numpy array
+        """
+        columns = Columns(*self.table_info(table_name))
+        rows = []
+        for row in self.iter_rows(table_name, page_size=page_size, **query):
+            rows.append(row)
+            if len(rows) >= page_size:
+                columns.extend(rows)
+                rows = []
+        columns.extend(rows)
+        return columns.to_dict(use_numpy)
 
     def close_connection(self):
         self.conn.close()
+
+class WriteBuffer:
+    """Collects inserts and deletes and commits them in groups
+
+    The buffer is written in one transaction once it holds max_rows rows
+    or its oldest row waited max_seconds, checked whenever a row is added.
+    Use it as a context manager or call flush() before reading.
+
+    Args:
+        db_manager: DatabaseManager to write with
+        table_name: table the rows go to
+        max_rows: size threshold
+        max_seconds: time threshold
+        unique: upsert on the email instead of plain inserts
+    """
+    def __init__(self, db_manager, table_name, max_rows=DEFAULT_BUFFER_ROWS,
+                 max_seconds=DEFAULT_BUFFER_SECONDS, unique=True):
+        self.db_manager = db_manager
+        self.table_name = table_name
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.unique = unique
+        self.inserts = []
+        self.deletes = []
+        self.oldest = None
+        self.rows_written = 0
+        self.commits = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self.inserts) + len(self.deletes)
+
+    def insert(self, row):
+        """Queues a row, its values in the order of data_columns()"""
+        self._flush_pending_deletes()
+        self.inserts.append(row)
+        self._added()
+
+    def delete(self, email):
+        """Queues the deletion of the record with this email"""
+        self._flush_pending_inserts()
+        self.deletes.append(email)
+        self._added()
+
+    def _added(self):
+        now = time.monotonic()
+        if self.oldest is None:
+            self.oldest = now
+        if len(self) >= self.max_rows or now - self.oldest >= self.max_seconds:
+            self.flush()
+
+    # Inserts and deletes of the same email have to be applied in order
+    def _flush_pending_deletes(self):
+        if self.deletes:
+            self.flush()
+
+    def _flush_pending_inserts(self):
+        if self.inserts:
+            self.flush()
+
+    def flush(self):
+        """Commits the buffered rows in one transaction
+
+        Returns:
+            number of rows written
+        """
+        if not len(self):
+            return 0
+        start = time.perf_counter()
+        rows = len(self)
+        with self.db_manager.transaction():
+            if self.inserts:
+                if self.unique:
+                    self.db_manager.upsert(self.table_name, self.inserts)
+                else:
+                    self.db_manager.insert_data(self.table_name, self.inserts)
+            if self.deletes:
+                self.db_manager.delete_many(self.table_name, self.deletes)
+        self.seconds += time.perf_counter() - start
+        self.rows_written += rows
+        self.commits += 1
+        self.inserts = []
+        self.deletes = []
+        self.oldest = None
+        return rows
+
+    def rows_per_second(self):
+        """Write throughput over all flushes so far"""
+        if not self.seconds:
+            return 0.0
+        return self.rows_written / self.seconds
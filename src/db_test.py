@@ -1,6 +1,6 @@
 import sqlite3
 import unittest
-from db import DatabaseManager
+from db import DatabaseManager, ResultCache
 
 class TestDatabaseManager(unittest.TestCase):
     def setUp(self):
@@ -87,5 +87,384 @@ class TestDatabaseManager(unittest.TestCase):
         self.assertEqual(len(result), len(expected_data))
         self.assertCountEqual(result, expected_data)
 
+class TestBulkWrites(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.table_name = "users"
+        self.db_manager.create_table(self.table_name, [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+        self.db_manager.insert_data(self.table_name, [(f"user{i}", f"user{i}@example.com")
+                                                      for i in range(1000)])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def count(self):
+        self.db_manager.cursor.execute(f"SELECT COUNT(*) FROM {self.table_name}")
+        return self.db_manager.cursor.fetchone()[0]
+
+    def test_upsert_keeps_rowid(self):
+        changed = self.db_manager.upsert(self.table_name, [("Alice", "user0@example.com"),
+                                                           ("Bob", "bob@example.com")])
+        self.assertEqual(changed, 2)
+        rows, _ = self.db_manager.fetch_page(self.table_name, 1)
+        self.assertEqual(rows, [(1, "Alice", "user0@example.com")])
+        self.assertEqual(self.count(), 1001)
+
+    def test_upsert_from(self):
+        self.db_manager.cursor.execute("CREATE TEMP TABLE staged (name TEXT, email TEXT)")
+        self.db_manager.cursor.executemany("INSERT INTO staged VALUES (?, ?)",
+                                           [("Alice", "user1@example.com"),
+                                            ("Bob", "bob@example.com")])
+        self.assertEqual(self.db_manager.upsert_from(self.table_name, "staged"), 2)
+        self.assertEqual(self.count(), 1001)
+        rows, _ = self.db_manager.fetch_page(self.table_name, 1, after=1)
+        self.assertEqual(rows, [(2, "Alice", "user1@example.com")])
+
+    def test_delete_many_in_list(self):
+        deleted = self.db_manager.delete_many(self.table_name, ["user1@example.com",
+                                                                "user2@example.com",
+                                                                "nobody@example.com"])
+        self.assertEqual(deleted, 2)
+        self.assertEqual(self.db_manager.delete_many(self.table_name, []), 0)
+        self.assertEqual(self.count(), 998)
+
+    def test_delete_many_temp_table(self):
+        deleted = self.db_manager.delete_many(self.table_name,
+                                              (f"user{i}@example.com" for i in range(0, 1000, 2)))
+        self.assertEqual(deleted, 500)
+        deleted = self.db_manager.delete_many(self.table_name,
+                                              [f"user{i}@example.com" for i in range(600)])
+        self.assertEqual(deleted, 300)
+        self.assertEqual(self.count(), 200)
+        self.assertFalse(self.db_manager.conn.in_transaction)
+
+    def test_delete_all(self):
+        self.assertEqual(self.db_manager.delete_all(self.table_name), 1000)
+        self.assertEqual(self.count(), 0)
+
+class TestStatementRegistry(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.db_manager.create_table("users", [
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_statements_are_reused(self):
+        for i in range(3):
+            self.db_manager.insert_data("users", [(f"user{i}", f"user{i}@example.com")])
+            self.db_manager.fetch_data("users")
+        self.db_manager.fetch_page("users", 10, after=1)
+        self.db_manager.fetch_page("users", 10, after=2)
+        self.db_manager.fetch_page("users", 10)
+        self.assertEqual(self.db_manager.statement_stats(),
+                         {"hits": 5, "misses": 4, "statements": 4})
+
+    def test_table_name_is_checked(self):
+        with self.assertRaises(ValueError):
+            self.db_manager.fetch_data("users; DROP TABLE users")
+        with self.assertRaises(ValueError):
+            self.db_manager.insert_data("users (name) SELECT", [])
+        with self.assertRaises(ValueError):
+            self.db_manager.create_table("bad name", [{"name": "a", "type": "TEXT"}])
+        self.assertEqual(self.db_manager.statement_stats()["statements"], 0)
+
+class TestIndexes(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.table_name = "users"
+        self.columns = [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT", "index": True},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ]
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def indexes(self):
+        self.db_manager.cursor.execute("SELECT name, sql FROM sqlite_master "
+                                       "WHERE type = 'index' AND sql IS NOT NULL")
+        return dict(self.db_manager.cursor.fetchall())
+
+    def test_index_statements(self):
+        statements = DatabaseManager.index_statements(self.table_name, self.columns, [
+            {"columns": ["name", "email"]},
+            {"name": "covering", "columns": ["email"], "include": ["name"], "unique": True},
+            {"columns": ["email"], "where": "name IS NOT NULL"}
+        ])
+        self.assertEqual(list(statements.values()), [
+            "CREATE INDEX idx_users_name ON users (name)",
+            "CREATE INDEX idx_users_name_email ON users (name, email)",
+            "CREATE UNIQUE INDEX covering ON users (email, name)",
+            "CREATE INDEX idx_users_email ON users (email) WHERE name IS NOT NULL"
+        ])
+        with self.assertRaises(ValueError):
+            DatabaseManager.index_statements(self.table_name, [], [{"columns": ["a b"]}])
+
+    def test_create_table_with_indexes(self):
+        self.db_manager.create_table(self.table_name, self.columns)
+        self.assertIn("idx_users_name", self.indexes())
+        self.db_manager.cursor.execute("EXPLAIN QUERY PLAN SELECT * FROM users WHERE name = ?",
+                                       ("Alice",))
+        self.assertIn("idx_users_name", str(self.db_manager.cursor.fetchall()))
+        self.assertEqual(self.db_manager.create_indexes(self.table_name, self.columns), 0)
+
+    def test_migrate_indexes(self):
+        self.db_manager.create_table(self.table_name, self.columns)
+        self.db_manager.cursor.execute("CREATE INDEX manual ON users (email, name)")
+        changes = self.db_manager.create_indexes(self.table_name, self.columns, [
+            {"name": "idx_users_name", "columns": ["name"], "where": "name IS NOT NULL"},
+            {"columns": ["name", "email"]}
+        ])
+        # name is declared twice, the table level definition wins
+        self.assertEqual(changes, 3)
+        self.assertEqual(self.indexes(), {
+            "idx_users_name": "CREATE INDEX idx_users_name ON users (name) "
+                              "WHERE name IS NOT NULL",
+            "idx_users_name_email": "CREATE INDEX idx_users_name_email ON users (name, email)",
+            "manual": "CREATE INDEX manual ON users (email, name)"
+        })
+        self.columns[1]["index"] = False
+        self.assertEqual(self.db_manager.create_indexes(self.table_name, self.columns), 2)
+        self.assertEqual(list(self.indexes()), ["manual"])
+
+class TestWriteBatching(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.table_name = "test_table"
+        self.db_manager.create_table(self.table_name, [
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_transaction_commits_once(self):
+        with self.db_manager.transaction():
+            self.db_manager.insert_data(self.table_name, [("John Doe", "john@example.com")])
+            self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com")])
+            self.assertTrue(self.db_manager.conn.in_transaction)
+        self.assertFalse(self.db_manager.conn.in_transaction)
+        self.assertEqual(len(self.db_manager.fetch_data(self.table_name)), 2)
+
+    def test_transaction_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.db_manager.transaction():
+                self.db_manager.insert_data(self.table_name, [("John Doe", "john@example.com")])
+                with self.db_manager.transaction():
+                    self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com")])
+                raise RuntimeError("abort")
+        self.assertEqual(self.db_manager.fetch_data(self.table_name), [])
+
+    def test_write_buffer_size_threshold(self):
+        write_buffer = self.db_manager.write_buffer(self.table_name, max_rows=3, max_seconds=60)
+        for i in range(7):
+            write_buffer.insert((f"user{i}", f"user{i}@example.com"))
+        self.assertEqual(write_buffer.commits, 2)
+        self.assertEqual(len(write_buffer), 1)
+        write_buffer.flush()
+        self.assertEqual(write_buffer.rows_written, 7)
+        self.assertEqual(len(self.db_manager.fetch_data(self.table_name)), 7)
+        self.assertGreater(write_buffer.rows_per_second(), 0)
+
+    def test_write_buffer_time_threshold(self):
+        write_buffer = self.db_manager.write_buffer(self.table_name, max_rows=100, max_seconds=0)
+        write_buffer.insert(("John Doe", "john@example.com"))
+        self.assertEqual(write_buffer.commits, 1)
+        self.assertEqual(len(write_buffer), 0)
+
+    def test_write_buffer_keeps_order(self):
+        with self.db_manager.write_buffer(self.table_name, max_rows=100, max_seconds=60) as buf:
+            buf.insert(("John Doe", "john@example.com"))
+            buf.insert(("Alice", "alice@example.com"))
+            buf.delete("john@example.com")
+            buf.insert(("John", "john@example.com"))
+        self.assertCountEqual(self.db_manager.fetch_data(self.table_name),
+                              [("Alice", "alice@example.com"), ("John", "john@example.com")])
+
+class TestPagination(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.table_name = "test_table"
+        self.db_manager.create_table(self.table_name, [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+        self.db_manager.insert_data(self.table_name, [(f"user{i}", f"user{i}@example.com")
+                                                      for i in range(10)])
+        self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com")])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_fetch_page(self):
+        rows, last_key = self.db_manager.fetch_page(self.table_name, 4)
+        self.assertEqual([row[0] for row in rows], [1, 2, 3, 4])
+        self.assertEqual(last_key, 4)
+        rows, last_key = self.db_manager.fetch_page(self.table_name, 4, after=last_key,
+                                                    columns=["email"])
+        self.assertEqual(rows[0], ("user4@example.com",))
+        self.assertEqual(self.db_manager.fetch_page(self.table_name, 4, after=11), ([], None))
+
+    def test_iter_rows(self):
+        rows = list(self.db_manager.iter_rows(self.table_name, page_size=3))
+        self.assertEqual(rows, self.db_manager.fetch_data(self.table_name))
+        rows = list(self.db_manager.iter_rows(self.table_name, limit=5, page_size=3, after=2))
+        self.assertEqual([row[0] for row in rows], [3, 4, 5, 6, 7])
+
+    def test_prefix_filters(self):
+        rows = list(self.db_manager.iter_rows(self.table_name, name_prefix="user1"))
+        self.assertEqual(rows, [(2, "user1", "user1@example.com")])
+        rows = list(self.db_manager.iter_rows(self.table_name, email_prefix="al",
+                                              columns=["name"]))
+        self.assertEqual(rows, [("Alice",)])
+
+    def test_invalid_column(self):
+        with self.assertRaises(ValueError):
+            self.db_manager.fetch_page(self.table_name, columns=["name; DROP TABLE x"])
+
+class TestTableColumns(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.columns = [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "email", "type": "TEXT", "unique": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "age", "type": "INTEGER"}
+        ]
+        self.db_manager.create_table("people", self.columns)
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_statements_follow_the_columns(self):
+        self.assertEqual(self.db_manager.data_columns("people"), ("email", "name", "age"))
+        self.db_manager.insert_data("people", [("a@x", "A", 30)])
+        self.db_manager.upsert("people", [("a@x", "B", 31), ("c@x", "C", 40)])
+        self.assertEqual(self.db_manager.fetch_data("people"),
+                         [(1, "a@x", "B", 31), (2, "c@x", "C", 40)])
+        columns, rows = self.db_manager.iter_data("people")
+        self.assertEqual(columns, ["id", "email", "name", "age"])
+        self.assertEqual(len(list(rows)), 2)
+
+    def test_register_existing_table(self):
+        other = DatabaseManager(":memory:")
+        other.cursor.execute("CREATE TABLE people (id INTEGER PRIMARY KEY, email TEXT, "
+                             "name TEXT, age INTEGER)")
+        self.assertEqual(other.column_names("people"), ("id", "email", "name", "age"))
+        other.register_table("people", self.columns)
+        other.insert_data("people", [("a@x", "A", 30)])
+        self.assertEqual(other.fetch_data("people"), [(1, "a@x", "A", 30)])
+        other.close_connection()
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache()
+        self.db_manager = DatabaseManager(":memory:", result_cache=self.cache)
+        self.db_manager.create_table("users", [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+        self.db_manager.create_table("other", [{"name": "email", "type": "TEXT"}])
+        self.db_manager.insert_data("users", [("A", "a@x"), ("B", "b@x")])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_repeated_reads_hit(self):
+        first = self.db_manager.fetch_data("users")
+        self.assertEqual(self.db_manager.fetch_data("users"), first)
+        self.db_manager.fetch_page("users", 1)
+        self.db_manager.fetch_page("users", 1)
+        stats = self.db_manager.cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 2, 2))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_writes_invalidate_their_table(self):
+        self.db_manager.fetch_data("users")
+        self.db_manager.fetch_data("other")
+        self.db_manager.insert_data_unique("users", [("C", "c@x")])
+        self.assertEqual(len(self.db_manager.fetch_data("users")), 3)
+        self.db_manager.delete_many("users", ["a@x"])
+        self.assertEqual(len(self.db_manager.fetch_data("users")), 2)
+        self.db_manager.delete_all("users")
+        self.assertEqual(self.db_manager.fetch_data("users"), [])
+        self.db_manager.fetch_data("other")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_shared_between_connections(self):
+        other = DatabaseManager(":memory:", result_cache=self.cache)
+        other.cursor.execute("CREATE TABLE users (name TEXT, email TEXT)")
+        self.db_manager.fetch_data("users")
+        other.insert_data("users", [("Z", "z@x")])
+        self.db_manager.fetch_data("users")
+        self.assertEqual(self.cache.hits, 0)
+        other.close_connection()
+
+    def test_uncommitted_reads_are_not_cached(self):
+        with self.db_manager.transaction():
+            self.db_manager.upsert("users", [("C", "c@x")])
+            self.assertEqual(len(self.db_manager.fetch_data("users")), 3)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_memory_bound_and_ttl(self):
+        self.cache.max_bytes = 1
+        self.db_manager.fetch_data("users")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.cache.max_bytes = 1024 * 1024
+        self.cache.ttl = -1
+        self.db_manager.fetch_data("users")
+        self.db_manager.fetch_data("users")
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_lru_eviction(self):
+        self.db_manager.fetch_page("users", 1)
+        self.cache.max_bytes = self.cache.bytes + 1
+        self.db_manager.fetch_page("users", 1, after=1)
+        self.assertEqual((self.cache.evictions, self.cache.stats()["entries"]), (1, 1))
+        # The first page was the least recently used
+        self.db_manager.fetch_page("users", 1, after=1)
+        self.assertEqual(self.cache.hits, 1)
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.db_manager.create_table("users", [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True},
+            {"name": "score", "type": "REAL"}
+        ])
+        self.db_manager.insert_data("users", [(f"user{i}", f"user{i}@x", i / 2)
+                                              for i in range(25)])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def test_iter_records(self):
+        records = list(self.db_manager.iter_records("users", email_prefix="user1"))
+        self.assertEqual(type(records[0]).__name__, "UsersRecord")
+        self.assertEqual(records[0].as_dict(),
+                         {"id": 2, "name": "user1", "email": "user1@x", "score": 0.5})
+        self.assertEqual(len(records), 11)
+
+    def test_fetch_columns(self):
+        columns = self.db_manager.fetch_columns("users", use_numpy=False, page_size=10)
+        self.assertEqual(columns["id"].typecode, "q")
+        self.assertEqual(list(columns["id"]), list(range(1, 26)))
+        self.assertEqual(columns["score"][24], 12.0)
+        self.assertEqual(columns["name"][:2], ["user0", "user1"])
+
 if __name__ == '__main__':
     unittest.main()
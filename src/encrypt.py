@@ -2,20 +2,66 @@
 import shutil
 import os
 import hashlib
+import mmap
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from Crypto.Cipher import AES
 
+from compress import check_codec, compress_chunks, decompress_chunks, header_codec
+from metrics import timed
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Size of the chunks read by the streaming pipeline, must be a multiple of
+# the AES block size
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# Digest used for the integrity checksums, any hashlib algorithm or an
+# xxhash one (xxh64, xxh3_128...) when the xxhash package is installed
+DEFAULT_DIGEST = "md5"
+
 class DatabaseEncryptor:
     """Database file encryptor"""
-    def __init__(self, key):
+    def __init__(self, key, chunk_size=DEFAULT_CHUNK_SIZE, digest=DEFAULT_DIGEST, workers=1,
+                 use_mmap=False, compression=None):
         self.key = key
         self.block_size = AES.block_size
+        if chunk_size <= 0 or chunk_size % self.block_size:
+            raise ValueError(f"Chunk size must be a positive multiple of {self.block_size}")
+        if workers < 1:
+            raise ValueError("At least one worker is needed")
+        self.chunk_size = chunk_size
+        # Each worker processes one chunk_size segment of every read
+        self.workers = workers
+        self._pool = None
+        # Map the files instead of streaming them through read()/write()
+        self.use_mmap = use_mmap
+        self.digest = digest
+        # Fail early on an unknown algorithm
+        self._new_digest()
+        # Codec compressing the plain text before it is encrypted, None to
+        # keep the plain SQLite layout. Decryption detects it on its own.
+        self.compression = check_codec(compression) if compression else None
         self.logger = None
+        # working copy -> state recorded when it was decrypted
+        self.snapshots = {}
 
     def set_logger(self, logger):
         """Sets the logger"""
         self.logger = logger
 
+    def _new_digest(self):
+        """Returns a new hash object for the configured digest"""
+        if self.digest.startswith("xxh"):
+            if xxhash is None:
+                raise ValueError(f"Digest {self.digest} needs the xxhash package")
+            return getattr(xxhash, self.digest)()
+        return hashlib.new(self.digest)
+
     def _pad(self, data):
         padding_length = self.block_size - len(data) % self.block_size
         padding = bytes([padding_length]) * padding_length
@@ -43,33 +89,74 @@ class DatabaseEncryptor:
         encrypted_file_path = os.path.join(file_path, output_file)
         return encrypted_file_path
 
-    def encrypt_database(self, db_file):
+    def get_plain_db_name(self, db_file):
+        """Returns the name of the plain text working copy of db_file
+
+        Args:
+            db_file : Encrypted or plain file
+
+        Returns:
+            plain file path
+        """
+        encrypted_file_path = self.get_encrypted_db_name(db_file)
+        return encrypted_file_path[:-len(".enc")]
+
+    @timed("encrypt.encrypt_database")
+    def encrypt_database(self, db_file, checkpoint=False):
         """Encrypts database file
 
+        A working copy created by decrypt_database() only has the blocks
+        that changed since then re-encrypted and written.
+
         Args:
             db_file : Input file to be read
+            checkpoint : Keep tracking db_file as a working copy, the next
+                call only writes what changed after this one
 
         Returns:
             Encrypted file informtation
         """
+        snapshot = self.snapshots.get(db_file)
+        if snapshot and not snapshot["compressed"] and not self.compression:
+            return self._encrypt_changed_blocks(db_file, checkpoint)
+        # A compressed stream shifts whenever anything changes, it is
+        # always written in full
+        self.snapshots.pop(db_file, None)
+
         # db_file is unencrypted file and output_file is the encrypted file
         # identifying file and path
-        plain_md5 = self.calculate_md5(db_file)
-        encrypted_file_path = self.get_encrypted_db_name(db_file)
-        self.encrypt_file_in_memory(encrypted_file_path)
-        encrypted_md5 = self.calculate_md5(encrypted_file_path)
-        if self.logger:
-            self.logger.log_info(f"MD5 of Encrypted File: {encrypted_md5} & Plain Text: {plain_md5}")
+        if snapshot:
+            encrypted_file_path = snapshot["encrypted_file"]
         else:
-            print(f"MD5 of Encrypted File: {encrypted_md5} & Plain Text: {plain_md5}")
-        return encrypted_file_path, encrypted_md5, plain_md5
+            encrypted_file_path = self.get_encrypted_db_name(db_file)
+        _, encrypted_digest, plain_digest = self._encrypt(db_file, encrypted_file_path)
+        self._log_digests(encrypted_digest, plain_digest)
+        if checkpoint:
+            block_digests = []
+            with open(db_file, 'rb') as file:
+                for _ in self._record_blocks(self._read_chunks(file), block_digests):
+                    pass
+            self.snapshots[db_file] = {
+                "encrypted_file": encrypted_file_path,
+                "block_digests": block_digests,
+                "size": os.path.getsize(db_file),
+                "encrypted_digest": encrypted_digest,
+                "plain_digest": plain_digest,
+                "compressed": bool(self.compression),
+            }
+        return encrypted_file_path, encrypted_digest, plain_digest
 
 
-    def decrypt_database(self, db_file):
+    @timed("encrypt.decrypt_database")
+    def decrypt_database(self, db_file, working_file=None):
         """Decrypt database file
 
         Args:
             db_file: Path to the DB_file
+            working_file: Decrypt into this file and leave the encrypted
+                file untouched, the digest of every block is recorded so
+                encrypt_database(working_file) can write back only the
+                blocks that changed
 
         Returns:
             decrypted_file, plainmd5, encryptedmd5
@@ -78,14 +165,104 @@ class DatabaseEncryptor:
         # identifying file and path
 
         encrypted_file_path = self.get_encrypted_db_name(db_file)
-        encrypted_md5 = self.calculate_md5(encrypted_file_path)
-        self.decrypt_file_in_memory(encrypted_file_path)
-        plain_md5 = self.calculate_md5(encrypted_file_path)
-        if not self.logger:
-            print(f"MD5 of Encrypted File: {encrypted_md5} & Plain Text: {plain_md5}")
+        if working_file:
+            compressed = self.is_compressed(encrypted_file_path)
+            block_digests = []
+            _, plain_digest, encrypted_digest = self._decrypt(
+                encrypted_file_path, working_file, block_digests)
+            self.snapshots[working_file] = {
+                "encrypted_file": encrypted_file_path,
+                "block_digests": block_digests,
+                "size": os.path.getsize(working_file),
+                "encrypted_digest": encrypted_digest,
+                "plain_digest": plain_digest,
+                "compressed": compressed,
+            }
+            db_file = working_file
+        else:
+            _, plain_digest, encrypted_digest = self._decrypt(encrypted_file_path)
+        self._log_digests(encrypted_digest, plain_digest)
+        return db_file, plain_digest, encrypted_digest
+
+    def _log_digests(self, encrypted_digest, plain_digest):
+        message = (f"{self.digest.upper()} of Encrypted File: {encrypted_digest} "
+                   f"& Plain Text: {plain_digest}")
+        if self.logger:
+            self.logger.log_info(message)
         else:
-            self.logger.log_info(f"MD5 of Encrypted File: {encrypted_md5} & Plain Text: {plain_md5}")
-        return db_file, plain_md5, encrypted_md5
+            print(message)
+
+    def discard_working_copy(self, working_file):
+        """Removes a working copy without writing anything back
+
+        Returns:
+            Encrypted file informtation recorded at decryption
+        """
+        snapshot = self.snapshots.pop(working_file)
+        if os.path.exists(working_file):
+            os.remove(working_file)
+        return snapshot["encrypted_file"], snapshot["encrypted_digest"], snapshot["plain_digest"]
+
+    def _block_digest(self, data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def _encrypt_changed_blocks(self, working_file, checkpoint=False):
+        """Re-encrypts the blocks of working_file that changed since it was
+        decrypted and patches them into the encrypted file
+
+        ECB keeps every block at the same offset in the encrypted file, so
+        unchanged blocks are only read back to update the checksum.
+
+        Returns:
+            Encrypted file informtation
+        """
+        snapshot = self.snapshots.pop(working_file)
+        encrypted_file_path = snapshot["encrypted_file"]
+        old_digests = snapshot["block_digests"]
+        old_size = snapshot["size"]
+        size = os.path.getsize(working_file)
+
+        hash_plain = self._new_digest()
+        hash_encrypted = self._new_digest()
+        block_digests = []
+        written = 0
+        with open(working_file, 'rb') as plain, open(encrypted_file_path, 'r+b') as encrypted:
+            for index in range(max(1, -(-size // self.chunk_size))):
+                data = plain.read(self.chunk_size)
+                hash_plain.update(data)
+                block_digests.append(self._block_digest(data))
+                last = plain.tell() >= size
+                unchanged = (index < len(old_digests)
+                             and old_digests[index] == block_digests[-1]
+                             and not (last and size != old_size))
+                if unchanged:
+                    encrypted.seek(index * self.chunk_size)
+                    length = len(self._pad(data)) if last else len(data)
+                    hash_encrypted.update(encrypted.read(length))
+                    continue
+                block = self._crypt(self._pad(data) if last else data, False)
+                encrypted.seek(index * self.chunk_size)
+                encrypted.write(block)
+                hash_encrypted.update(block)
+                written += 1
+            if written:
+                encrypted.truncate(size - size % self.block_size + self.block_size)
+                encrypted.flush()
+                os.fsync(encrypted.fileno())
+
+        if self.logger:
+            self.logger.log_info("Re-encrypted %d changed blocks of %s", written,
+                                 encrypted_file_path)
+        if checkpoint:
+            self.snapshots[working_file] = {
+                "encrypted_file": encrypted_file_path,
+                "block_digests": block_digests,
+                "size": size,
+                "encrypted_digest": hash_encrypted.hexdigest(),
+                "plain_digest": hash_plain.hexdigest(),
+                "compressed": False,
+            }
+        return encrypted_file_path, hash_encrypted.hexdigest(), hash_plain.hexdigest()
 
     #################################################
     def encrypt_file_in_memory(self, file_path):
@@ -112,32 +289,344 @@ class DatabaseEncryptor:
             file.write(unpadded_data)
         return file_path
 
-    ####################################################
-    def encrypt_file(self, input_file, output_file):
+    #################################################
+    def _read_chunks(self, file):
+        """Yields chunk_size pieces of an open file until EOF, one per worker"""
+        return iter(lambda: file.read(self.chunk_size * self.workers), b'')
+
+    def _crypt(self, data, decrypt, output=None):
+        """Runs the cipher over block aligned data
+
+        With more than one worker the data is split in chunk_size segments
+        handled by the pool, each one writing straight into its slice of
+        output. The returned view is only valid until output is reused.
+        """
+        if self.workers == 1:
+            cipher = AES.new(self.key, AES.MODE_ECB)
+            run = cipher.decrypt if decrypt else cipher.encrypt
+            if output is None:
+                return run(data)
+            target = memoryview(output)[:len(data)]
+            run(data, output=target)
+            return target
+
+        if output is None or len(output) < len(data):
+            output = bytearray(len(data))
+        source = memoryview(data)
+        target = memoryview(output)[:len(data)]
+
+        def run_segment(offset):
+            segment = slice(offset, offset + self.chunk_size)
+            cipher = AES.new(self.key, AES.MODE_ECB)
+            if decrypt:
+                cipher.decrypt(source[segment], output=target[segment])
+            else:
+                cipher.encrypt(source[segment], output=target[segment])
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="encrypt")
+        # map() returns in order, consuming it waits for every segment
+        list(self._pool.map(run_segment, range(0, len(data), self.chunk_size)))
+        return target
+
+    def _output_buffer(self):
+        """Buffer reused by the parallel path for every chunk of a stream"""
+        if self.workers == 1:
+            return None
+        return bytearray(self.chunk_size * self.workers)
+
+    def _encrypt_chunks(self, chunks):
+        """Encrypts a stream of plaintext chunks, padding only the final block"""
+        output = self._output_buffer()
+        pending = b''
+        for chunk in chunks:
+            data = pending + chunk if pending else chunk
+            usable = len(data) - len(data) % self.block_size
+            if usable:
+                yield self._crypt(memoryview(data)[:usable], False, output)
+            pending = bytes(data[usable:])
+        yield self._crypt(self._pad(pending), False)
+
+    def _decrypt_chunks(self, chunks):
+        """Decrypts a stream of ciphertext chunks, holding back the last
+        block so the padding can be removed once EOF is reached"""
+        output = self._output_buffer()
+        pending = b''
+        for chunk in chunks:
+            data = pending + chunk if pending else chunk
+            usable = len(data) - len(data) % self.block_size - self.block_size
+            if usable > 0:
+                yield self._crypt(memoryview(data)[:usable], True, output)
+                pending = data[usable:]
+            else:
+                pending = data
+        if len(pending) != self.block_size:
+            raise ValueError("Invalid ciphertext length")
+        yield self._unpad(self._crypt(pending, True))
+
+    def _hashed(self, chunks, digest):
+        """Passes chunks through, feeding each one to digest"""
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    @contextmanager
+    def _atomic_output(self, output_file):
+        """Yields a temporary file next to output_file which is swapped in
+        once the block completes"""
+        directory = os.path.dirname(os.path.abspath(output_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w+b') as file:
+                yield file
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(output_file):
+                shutil.copymode(output_file, temp_path)
+            os.replace(temp_path, output_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _write_atomic(self, chunks, output_file):
+        """Writes the chunks to a temporary file next to output_file and
+        swaps it in once everything was written
+
+        Args:
+            chunks: iterable of bytes
+            output_file: final destination
+
+        Returns:
+            digest of the data written
+        """
+        digest = self._new_digest()
+        with self._atomic_output(output_file) as file:
+            for chunk in chunks:
+                digest.update(chunk)
+                file.write(chunk)
+        return digest.hexdigest()
+
+    def encrypt_stream(self, input_file, output_file=None):
+        """Encrypts a file chunk by chunk with bounded memory
+
+        Args:
+            input_file: plain text file
+            output_file: destination, defaults to encrypting in place
+
+        Returns:
+            output_file, digest of the encrypted data, digest of the input
+        """
+        output_file = output_file or input_file
+        plain_digest = self._new_digest()
         with open(input_file, 'rb') as file:
-            plaintext = file.read()
+            chunks = self._compressed(self._hashed(self._read_chunks(file), plain_digest))
+            encrypted_digest = self._write_atomic(self._encrypt_chunks(chunks), output_file)
+        return output_file, encrypted_digest, plain_digest.hexdigest()
 
-        cipher = AES.new(self.key, AES.MODE_ECB)
-        padded_plaintext = self._pad(plaintext)
-        encrypted_data = cipher.encrypt(padded_plaintext)
+    def _compressed(self, chunks):
+        """Compresses the plain text chunks when a codec is configured"""
+        if self.compression:
+            return compress_chunks(chunks, self.compression)
+        return chunks
 
-        with open(output_file, 'wb') as file:
-            file.write(encrypted_data)
-        return output_file
+    def is_compressed(self, encrypted_file):
+        """Tells from its first block whether encrypted_file holds a
+        compressed stream"""
+        with open(encrypted_file, 'rb') as file:
+            first_block = file.read(self.block_size)
+        if len(first_block) < self.block_size:
+            return False
+        return header_codec(bytes(self._crypt(first_block, True))) is not None
 
-    def decrypt_file(self, input_file, output_file):
+    def _record_blocks(self, chunks, block_digests):
+        """Passes chunks through, appending the digest of every chunk_size
+        block of the stream to block_digests"""
+        pending = b''
+        for chunk in chunks:
+            yield chunk
+            pending += chunk
+            while len(pending) >= self.chunk_size:
+                block_digests.append(self._block_digest(pending[:self.chunk_size]))
+                pending = pending[self.chunk_size:]
+        if pending or not block_digests:
+            block_digests.append(self._block_digest(pending))
+
+    def decrypt_stream(self, input_file, output_file=None, block_digests=None):
+        """Decrypts a file chunk by chunk with bounded memory
+
+        Args:
+            input_file: encrypted file
+            output_file: destination, defaults to decrypting in place
+            block_digests: optional list receiving the digest of every
+                chunk_size block of plain text
+
+        Returns:
+            output_file, digest of the decrypted data, digest of the input
+        """
+        output_file = output_file or input_file
+        encrypted_digest = self._new_digest()
         with open(input_file, 'rb') as file:
-            encrypted_data = file.read()
+            chunks = self._hashed(self._read_chunks(file), encrypted_digest)
+            chunks = decompress_chunks(self._decrypt_chunks(chunks))
+            if block_digests is not None:
+                chunks = self._record_blocks(chunks, block_digests)
+            plain_digest = self._write_atomic(chunks, output_file)
+        return output_file, plain_digest, encrypted_digest.hexdigest()
 
-        cipher = AES.new(self.key, AES.MODE_ECB)
-        decrypted_data = cipher.decrypt(encrypted_data)
-        unpadded_data = self._unpad(decrypted_data)
+    def encrypt_bytes(self, data, output_file):
+        """Encrypts data held in memory into output_file, the plain text is
+        never written to disk
 
-        with open(output_file, 'wb') as file:
-            file.write(unpadded_data)
+        Returns:
+            output_file, digest of the encrypted data, digest of data
+        """
+        view = memoryview(data)
+        step = self.chunk_size * self.workers
+        chunks = (view[offset:offset + step] for offset in range(0, len(view), step))
+        plain_digest = self._new_digest()
+        encrypted_digest = self._write_atomic(
+            self._encrypt_chunks(self._compressed(self._hashed(chunks, plain_digest))),
+            output_file)
+        return output_file, encrypted_digest, plain_digest.hexdigest()
+
+    def decrypt_bytes(self, input_file):
+        """Decrypts a file into memory
 
-        return output_file
+        Returns:
+            bytearray of plain text, digest of it, digest of the input
+        """
+        encrypted_digest = self._new_digest()
+        plain_digest = self._new_digest()
+        data = bytearray()
+        with open(input_file, 'rb') as file:
+            chunks = self._hashed(self._read_chunks(file), encrypted_digest)
+            for chunk in decompress_chunks(self._decrypt_chunks(chunks)):
+                plain_digest.update(chunk)
+                data += chunk
+        return data, plain_digest.hexdigest(), encrypted_digest.hexdigest()
+
+    #################################################
+    def encrypt_mmap(self, input_file, output_file=None):
+        """Encrypts a file by mapping it and a preallocated output file
+
+        The cipher writes straight into the output mapping, only the final
+        block is copied to be padded.
+
+        Args:
+            input_file: plain text file
+            output_file: destination, defaults to encrypting in place
+
+        Returns:
+            output_file, digest of the encrypted data, digest of the input
+        """
+        output_file = output_file or input_file
+        size = os.path.getsize(input_file)
+        if not size:
+            # Empty files cannot be mapped
+            return self.encrypt_stream(input_file, output_file)
+
+        padded_size = size - size % self.block_size + self.block_size
+        plain_digest = self._new_digest()
+        encrypted_digest = self._new_digest()
+        with open(input_file, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source_map, \
+                self._atomic_output(output_file) as output:
+            output.truncate(padded_size)
+            with mmap.mmap(output.fileno(), padded_size) as target_map:
+                self._encrypt_mapped(source_map, target_map, plain_digest, encrypted_digest)
+                target_map.flush()
+        return output_file, encrypted_digest.hexdigest(), plain_digest.hexdigest()
+
+    def _encrypt_mapped(self, source_map, target_map, plain_digest, encrypted_digest):
+        # The views must not outlive this call, the maps cannot be closed
+        # while they exist
+        source = memoryview(source_map)
+        target = memoryview(target_map)
+        aligned = len(source) - len(source) % self.block_size
+        step = self.chunk_size * self.workers
+        for offset in range(0, aligned, step):
+            end = min(offset + step, aligned)
+            self._crypt(source[offset:end], False, target[offset:end])
+            plain_digest.update(source[offset:end])
+            encrypted_digest.update(target[offset:end])
+        plain_digest.update(source[aligned:])
+        self._crypt(self._pad(bytes(source[aligned:])), False, target[aligned:])
+        encrypted_digest.update(target[aligned:])
+
+    def decrypt_mmap(self, input_file, output_file=None, block_digests=None):
+        """Decrypts a file by mapping it and a preallocated output file
+
+        The last block is decrypted first to learn the padding, then the
+        cipher writes straight into the output mapping.
+
+        Args:
+            input_file: encrypted file
+            output_file: destination, defaults to decrypting in place
+            block_digests: optional list receiving the digest of every
+                chunk_size block of plain text
+
+        Returns:
+            output_file, digest of the decrypted data, digest of the input
+        """
+        output_file = output_file or input_file
+        size = os.path.getsize(input_file)
+        if not size or size % self.block_size:
+            raise ValueError("Invalid ciphertext length")
+
+        plain_digest = self._new_digest()
+        encrypted_digest = self._new_digest()
+        with open(input_file, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source_map, \
+                self._atomic_output(output_file) as output:
+            output.truncate(size)
+            with mmap.mmap(output.fileno(), size) as target_map:
+                plain_size = self._decrypt_mapped(source_map, target_map, plain_digest,
+                                                  encrypted_digest, block_digests)
+                target_map.flush()
+            output.truncate(plain_size)
+        return output_file, plain_digest.hexdigest(), encrypted_digest.hexdigest()
+
+    def _decrypt_mapped(self, source_map, target_map, plain_digest, encrypted_digest,
+                        block_digests):
+        # The views must not outlive this call, the maps cannot be closed
+        # while they exist
+        source = memoryview(source_map)
+        target = memoryview(target_map)
+        last = len(source) - self.block_size
+        step = self.chunk_size * self.workers
+        self._crypt(source[last:], True, target[last:])
+        plain_size = last + len(self._unpad(target[last:]))
+        for offset in range(0, last, step):
+            end = min(offset + step, last)
+            self._crypt(source[offset:end], True, target[offset:end])
+        encrypted_digest.update(source)
+        for offset in range(0, max(plain_size, 1), self.chunk_size):
+            block = target[offset:min(offset + self.chunk_size, plain_size)]
+            plain_digest.update(block)
+            if block_digests is not None:
+                block_digests.append(self._block_digest(block))
+        return plain_size
+
+    def _encrypt(self, input_file, output_file=None):
+        # The mapped output has to be sized up front, compressed output is not
+        if self.use_mmap and not self.compression:
+            return self.encrypt_mmap(input_file, output_file)
+        return self.encrypt_stream(input_file, output_file)
+
+    def _decrypt(self, input_file, output_file=None, block_digests=None):
+        if self.use_mmap and not self.is_compressed(input_file):
+            return self.decrypt_mmap(input_file, output_file, block_digests)
+        return self.decrypt_stream(input_file, output_file, block_digests)
+
+    ####################################################
+    def encrypt_file(self, input_file, output_file):
+        return self._encrypt(input_file, output_file)[0]
+
+    def decrypt_file(self, input_file, output_file):
+        return self._decrypt(input_file, output_file)[0]
 
+    @timed("encrypt.calculate_md5")
     def calculate_md5(self, file_path):
         hash_md5 = hashlib.md5()
         with open(file_path, 'rb') as file:
@@ -1,6 +1,7 @@
 import unittest
 import os
 import hashlib
+import tempfile
 
 from Crypto.Cipher import AES
 from encrypt import DatabaseEncryptor
@@ -54,5 +55,304 @@ class TestDatabaseEncryptor(unittest.TestCase):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
 
+class TestStreamingEncryption(unittest.TestCase):
+    """Tests for the chunked encryption pipeline"""
+    def setUp(self):
+        self.test_key = b'test_key_16bytes'
+        # Small chunks so that the tests cross chunk boundaries
+        self.db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.plain_file = os.path.join(self.temp_dir.name, 'plain.db')
+        self.encrypted_file = os.path.join(self.temp_dir.name, 'plain.db.enc')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, data):
+        with open(self.plain_file, 'wb') as f:
+            f.write(data)
+
+    def _read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def test_bytes_round_trip(self):
+        for size in (0, 15, 64, 1000):
+            data = os.urandom(size)
+            self._write(data)
+            _, encrypted_digest, plain_digest = self.db_encryptor.encrypt_bytes(
+                data, self.encrypted_file)
+            _, expected_encrypted, expected_plain = self.db_encryptor.encrypt_stream(
+                self.plain_file, self.plain_file + '.stream')
+            self.assertEqual(self._read(self.encrypted_file),
+                             self._read(self.plain_file + '.stream'))
+            self.assertEqual((encrypted_digest, plain_digest),
+                             (expected_encrypted, expected_plain))
+
+            plain, plain_digest, encrypted_digest = self.db_encryptor.decrypt_bytes(
+                self.encrypted_file)
+            self.assertEqual(plain, data)
+            self.assertEqual((plain_digest, encrypted_digest),
+                             (expected_plain, expected_encrypted))
+
+    def test_compressed_round_trip(self):
+        data = b"".join(f"user{i}@example.com".encode() for i in range(500))
+        self._write(data)
+        for workers, use_mmap in ((1, False), (2, True)):
+            encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, workers=workers,
+                                          use_mmap=use_mmap, compression="zlib")
+            _, encrypted_digest, plain_digest = encryptor._encrypt(self.plain_file,
+                                                                   self.encrypted_file)
+            self.assertLess(os.path.getsize(self.encrypted_file), len(data) // 2)
+            self.assertTrue(self.db_encryptor.is_compressed(self.encrypted_file))
+            # Any encryptor reads it back, with or without compression configured
+            _, decrypted_digest, read_digest = self.db_encryptor.decrypt_stream(
+                self.encrypted_file, self.plain_file + '.out')
+            self.assertEqual(self._read(self.plain_file + '.out'), data)
+            self.assertEqual((decrypted_digest, read_digest), (plain_digest, encrypted_digest))
+            self.assertEqual(encryptor.decrypt_bytes(self.encrypted_file)[0], data)
+
+        self.db_encryptor.encrypt_stream(self.plain_file, self.encrypted_file)
+        self.assertFalse(self.db_encryptor.is_compressed(self.encrypted_file))
+
+    def test_compressed_working_copy(self):
+        encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, compression="lzma")
+        self._write(b"a" * 1000)
+        encryptor.encrypt_file(self.plain_file, self.encrypted_file)
+        working_copy = os.path.join(self.temp_dir.name, 'work.db')
+        self.db_encryptor.decrypt_database(self.encrypted_file, working_copy)
+        with open(working_copy, 'ab') as f:
+            f.write(b"b" * 100)
+        # Written in full, patching blocks only works on uncompressed files
+        self.db_encryptor.encrypt_database(working_copy)
+        self.assertFalse(self.db_encryptor.is_compressed(self.encrypted_file))
+        self.db_encryptor.decrypt_stream(self.encrypted_file, self.plain_file)
+        self.assertEqual(self._read(self.plain_file), b"a" * 1000 + b"b" * 100)
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            DatabaseEncryptor(self.test_key, chunk_size=100)
+
+    def test_matches_whole_file_encryption(self):
+        # The streamed output is byte for byte the single shot output
+        data = os.urandom(1000)
+        self._write(data)
+        self.db_encryptor.encrypt_stream(self.plain_file, self.encrypted_file)
+
+        cipher = AES.new(self.test_key, AES.MODE_ECB)
+        expected = cipher.encrypt(self.db_encryptor._pad(data))
+        self.assertEqual(self._read(self.encrypted_file), expected)
+
+    def test_round_trip_sizes(self):
+        for size in (0, 1, 15, 16, 63, 64, 65, 128, 1000):
+            data = os.urandom(size)
+            self._write(data)
+            self.db_encryptor.encrypt_stream(self.plain_file)
+            self.db_encryptor.decrypt_stream(self.plain_file)
+            self.assertEqual(self._read(self.plain_file), data, size)
+
+    def test_returns_md5_of_output_and_input(self):
+        data = os.urandom(300)
+        self._write(data)
+        output, encrypted_md5, plain_md5 = self.db_encryptor.encrypt_stream(
+            self.plain_file, self.encrypted_file)
+        encrypted = self._read(self.encrypted_file)
+        self.assertEqual(output, self.encrypted_file)
+        self.assertEqual(encrypted_md5, hashlib.md5(encrypted).hexdigest())
+        self.assertEqual(plain_md5, hashlib.md5(data).hexdigest())
+
+        _, plain_md5, encrypted_md5 = self.db_encryptor.decrypt_stream(self.encrypted_file)
+        self.assertEqual(plain_md5, hashlib.md5(data).hexdigest())
+        self.assertEqual(encrypted_md5, hashlib.md5(encrypted).hexdigest())
+
+    def test_configurable_digest(self):
+        db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, digest="blake2b")
+        data = os.urandom(300)
+        self._write(data)
+        _, encrypted_digest, plain_digest = db_encryptor.encrypt_database(self.plain_file)
+        self.assertEqual(plain_digest, hashlib.blake2b(data).hexdigest())
+        self.assertEqual(encrypted_digest,
+                         hashlib.blake2b(self._read(self.encrypted_file)).hexdigest())
+
+    def test_unknown_digest(self):
+        with self.assertRaises(ValueError):
+            DatabaseEncryptor(self.test_key, digest="no_such_digest")
+
+    def test_failed_decrypt_leaves_file_untouched(self):
+        # Not a multiple of the block size, decryption fails half way
+        self._write(os.urandom(200))
+        with self.assertRaises(ValueError):
+            self.db_encryptor.decrypt_stream(self.plain_file)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['plain.db'])
+class TestParallelEncryption(unittest.TestCase):
+    """Tests for spreading the cipher over a worker pool"""
+    def setUp(self):
+        self.test_key = b'test_key_16bytes'
+        self.db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, workers=4)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.plain_file = os.path.join(self.temp_dir.name, 'plain.db')
+        self.encrypted_file = os.path.join(self.temp_dir.name, 'plain.db.enc')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def test_invalid_workers(self):
+        with self.assertRaises(ValueError):
+            DatabaseEncryptor(self.test_key, workers=0)
+
+    def test_matches_single_worker(self):
+        single = DatabaseEncryptor(self.test_key, chunk_size=64)
+        for size in (0, 15, 64, 255, 256, 257, 1000, 5000):
+            data = os.urandom(size)
+            with open(self.plain_file, 'wb') as f:
+                f.write(data)
+            _, parallel_md5, _ = self.db_encryptor.encrypt_stream(self.plain_file,
+                                                                  self.encrypted_file)
+            _, single_md5, _ = single.encrypt_stream(self.plain_file)
+            self.assertEqual(parallel_md5, single_md5, size)
+            self.assertEqual(self._read(self.encrypted_file), self._read(self.plain_file), size)
+
+    def test_round_trip(self):
+        data = os.urandom(5000)
+        with open(self.plain_file, 'wb') as f:
+            f.write(data)
+        self.db_encryptor.encrypt_stream(self.plain_file)
+        _, plain_md5, _ = self.db_encryptor.decrypt_stream(self.plain_file)
+        self.assertEqual(self._read(self.plain_file), data)
+        self.assertEqual(plain_md5, hashlib.md5(data).hexdigest())
+
+class TestMmapEncryption(unittest.TestCase):
+    """Tests for the memory mapped path"""
+    def setUp(self):
+        self.test_key = b'test_key_16bytes'
+        self.db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, use_mmap=True)
+        self.streaming = DatabaseEncryptor(self.test_key, chunk_size=64)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.plain_file = os.path.join(self.temp_dir.name, 'plain.db')
+        self.encrypted_file = os.path.join(self.temp_dir.name, 'plain.db.enc')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def test_matches_streaming(self):
+        for size in (0, 1, 16, 64, 100, 1000):
+            data = os.urandom(size)
+            with open(self.plain_file, 'wb') as f:
+                f.write(data)
+            mapped = self.db_encryptor.encrypt_mmap(self.plain_file, self.encrypted_file)
+            streamed = self.streaming.encrypt_stream(self.plain_file)
+            self.assertEqual(mapped[1:], streamed[1:], size)
+            self.assertEqual(self._read(self.encrypted_file), self._read(self.plain_file), size)
+
+    def test_round_trip_records_blocks(self):
+        for size in (0, 64, 1000):
+            data = os.urandom(size)
+            with open(self.plain_file, 'wb') as f:
+                f.write(data)
+            self.streaming.encrypt_stream(self.plain_file, self.encrypted_file)
+
+            mapped_blocks, streamed_blocks = [], []
+            mapped = self.db_encryptor.decrypt_mmap(self.encrypted_file, self.plain_file,
+                                                    mapped_blocks)
+            streamed = self.streaming.decrypt_stream(self.encrypted_file, None, streamed_blocks)
+            self.assertEqual(self._read(self.plain_file), data)
+            self.assertEqual(mapped[1:], streamed[1:])
+            self.assertEqual(mapped_blocks, streamed_blocks)
+
+    def test_invalid_ciphertext(self):
+        with open(self.encrypted_file, 'wb') as f:
+            f.write(os.urandom(100))
+        with self.assertRaises(ValueError):
+            self.db_encryptor.decrypt_mmap(self.encrypted_file)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['plain.db.enc'])
+
+    def test_parallel_workers(self):
+        db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64, workers=3, use_mmap=True)
+        data = os.urandom(5000)
+        with open(self.plain_file, 'wb') as f:
+            f.write(data)
+        db_encryptor.encrypt_database(self.plain_file)
+        db_encryptor.decrypt_database(self.encrypted_file, self.plain_file)
+        self.assertEqual(self._read(self.plain_file), data)
+
+class TestIncrementalEncryption(unittest.TestCase):
+    """Tests for re-encrypting only the changed blocks of a working copy"""
+    def setUp(self):
+        self.test_key = b'test_key_16bytes'
+        self.db_encryptor = DatabaseEncryptor(self.test_key, chunk_size=64)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.working_file = os.path.join(self.temp_dir.name, 'work.db')
+        self.encrypted_file = os.path.join(self.temp_dir.name, 'work.db.enc')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _encrypt(self, data):
+        with open(self.working_file, 'wb') as f:
+            f.write(data)
+        self.db_encryptor.encrypt_stream(self.working_file, self.encrypted_file)
+
+    def _expected(self, data):
+        cipher = AES.new(self.test_key, AES.MODE_ECB)
+        return cipher.encrypt(self.db_encryptor._pad(data))
+
+    def _read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def test_decrypt_keeps_encrypted_file(self):
+        self._encrypt(b'x' * 100)
+        encrypted = self._read(self.encrypted_file)
+        result = self.db_encryptor.decrypt_database(self.encrypted_file, self.working_file)
+        self.assertEqual(result[0], self.working_file)
+        self.assertEqual(self._read(self.encrypted_file), encrypted)
+        self.assertEqual(self._read(self.working_file), b'x' * 100)
+
+    def test_unchanged_working_copy_is_not_written(self):
+        self._encrypt(os.urandom(300))
+        _, plain_md5, encrypted_md5 = self.db_encryptor.decrypt_database(self.encrypted_file,
+                                                                         self.working_file)
+        before = os.stat(self.encrypted_file).st_mtime_ns
+        result = self.db_encryptor.encrypt_database(self.working_file)
+        self.assertEqual(result, (self.encrypted_file, encrypted_md5, plain_md5))
+        self.assertEqual(os.stat(self.encrypted_file).st_mtime_ns, before)
+
+    def test_changed_blocks_match_full_encryption(self):
+        original = os.urandom(300)
+        cases = [
+            original[:100] + b'changed' + original[107:],  # same size
+            original + os.urandom(50),                       # grown
+            original + os.urandom(84),                       # grown to a block multiple
+            original[:130],                                  # shrunk
+            original[:128],                                  # shrunk to a block multiple
+            b'',
+        ]
+        for data in cases:
+            self._encrypt(original)
+            self.db_encryptor.decrypt_database(self.encrypted_file, self.working_file)
+            with open(self.working_file, 'wb') as f:
+                f.write(data)
+
+            _, encrypted_md5, plain_md5 = self.db_encryptor.encrypt_database(self.working_file)
+            encrypted = self._read(self.encrypted_file)
+            self.assertEqual(encrypted, self._expected(data), len(data))
+            self.assertEqual(encrypted_md5, hashlib.md5(encrypted).hexdigest())
+            self.assertEqual(plain_md5, hashlib.md5(data).hexdigest())
+
+    def test_discard_working_copy(self):
+        self._encrypt(b'x' * 10)
+        self.db_encryptor.decrypt_database(self.encrypted_file, self.working_file)
+        self.db_encryptor.discard_working_copy(self.working_file)
+        self.assertFalse(os.path.exists(self.working_file))
+        self.assertEqual(self.db_encryptor.snapshots, {})
+
 if __name__ == '__main__':
     unittest.main()
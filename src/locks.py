@@ -0,0 +1,90 @@
+"""Advisory file locks coordinating the processes sharing a database
+
+The locks are flock() locks on files of their own, the database files
+are replaced while the locks are held. They only coordinate processes
+that take them, and are not available on platforms without fcntl, where
+acquiring them does nothing.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds between two attempts to take a lock with a timeout
+POLL_INTERVAL = 0.05
+
+class LockTimeout(Exception):
+    """The lock was not acquired in time"""
+    def __init__(self, path):
+        super().__init__(f"Timed out waiting for the lock on {path}")
+        self.path = path
+
+class FileLock:
+    """Shared or exclusive lock on a file, created when missing
+
+    Args:
+        path: lock file
+        timeout: seconds to wait for the lock, None waits as long as it takes
+    """
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self.fd = None
+        self.shared = None
+
+    def acquire(self, shared=False):
+        """Takes the lock, converting it when it is already held
+
+        Raises:
+            LockTimeout: the lock was not acquired within timeout
+        """
+        if fcntl is None:
+            return
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            if self.timeout is None:
+                fcntl.flock(self.fd, operation)
+            else:
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    try:
+                        fcntl.flock(self.fd, operation | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            raise LockTimeout(self.path) from None
+                        time.sleep(POLL_INTERVAL)
+        except BaseException:
+            if self.shared is None:
+                self._close()
+            raise
+        self.shared = shared
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self._close()
+
+    def _close(self):
+        os.close(self.fd)
+        self.fd = None
+        self.shared = None
+
+    @property
+    def locked(self):
+        return self.shared is not None
+
+    @contextmanager
+    def hold(self, shared=False):
+        """Holds the lock for the block"""
+        self.acquire(shared)
+        try:
+            yield self
+        finally:
+            self.release()
@@ -1,27 +1,117 @@
+import atexit
+import json
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+# Level of the records written to the log file
+FILE_LEVEL = logging.INFO
+# Records written between two flushes of the log file in queued mode
+BATCH_SIZE = 256
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line"""
+    def format(self, record):
+        entry = {"time": self.formatTime(record, self.datefmt), "level": record.levelname,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class _BatchingHandler(RotatingFileHandler):
+    """RotatingFileHandler that leaves flushing to its caller"""
+    def flush(self):
+        pass
+
+    def flush_now(self):
+        super().flush()
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues the record as is, the message is formatted by the writer thread"""
+    def prepare(self, record):
+        return record
 
 class CustomLogger:
-    def __init__(self, log_file, level):
+    """Logs to a file
+
+    The messages take %-style arguments, formatted only when the record is
+    actually written: log_debug("Decrypted %s", path).
+
+    Args:
+        log_file: file to write to
+        level: lowest level logged, the file only receives INFO and above
+        queued: hand the records to a background thread writing them in
+            batches instead of writing on the calling thread
+        json_format: write one JSON object per record
+        max_bytes: rotate the file once it reaches this size, 0 never
+        backup_count: rotated files kept
+    """
+    def __init__(self, log_file, level, queued=False, json_format=False, max_bytes=0,
+                 backup_count=3):
         self.log_file = log_file
         self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(level)  # Set the default log level
+        # Records the file handler would drop are not even created
+        self.logger.setLevel(max(level, FILE_LEVEL))  # Set the default log level
+
+        if json_format:
+            formatter = JsonFormatter(datefmt='%Y-%m-%d %H:%M:%S')
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+        handler_class = _BatchingHandler if queued else RotatingFileHandler
+        self.file_handler = handler_class(self.log_file, maxBytes=max_bytes,
+                                          backupCount=backup_count, delay=queued)
+        self.file_handler.setLevel(FILE_LEVEL)
+        self.file_handler.setFormatter(formatter)
 
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        self.queue = None
+        self._writer = None
+        if queued:
+            self.queue = queue.SimpleQueue()
+            self.handler = _DeferredQueueHandler(self.queue)
+            self._writer = threading.Thread(target=self._write_records, name="log-writer",
+                                            daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+        else:
+            self.handler = self.file_handler
+        self.logger.addHandler(self.handler)
 
-        file_handler = logging.FileHandler(self.log_file)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(formatter)
+    def _write_records(self):
+        """Writes queued records, flushing once per batch"""
+        while True:
+            record = self.queue.get()
+            batch = 0
+            while record is not None:
+                self.file_handler.handle(record)
+                batch += 1
+                if batch >= BATCH_SIZE:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.file_handler.flush_now()
+            if record is None:
+                return
 
-        self.logger.addHandler(file_handler)
+    def close(self):
+        """Writes the pending records and closes the file"""
+        self.logger.removeHandler(self.handler)
+        if self._writer is not None and self._writer.is_alive():
+            self.queue.put(None)
+            self._writer.join()
+        self.file_handler.close()
 
-    def log_info(self, message):
-        self.logger.info(message)
+    def log_info(self, message, *args):
+        self.logger.info(message, *args)
 
-    def log_debug(self, message):
-        self.logger.debug(message)
+    def log_debug(self, message, *args):
+        self.logger.debug(message, *args)
 
-    def log_warning(self, message):
-        self.logger.warning(message)
+    def log_warning(self, message, *args):
+        self.logger.warning(message, *args)
 
-    def log_error(self, message):
-        self.logger.error(message)
+    def log_error(self, message, *args):
+        self.logger.error(message, *args)
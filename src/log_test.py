@@ -0,0 +1,65 @@
+"""Unit test for the CustomLogger"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from log import CustomLogger
+
+class TestCustomLogger(unittest.TestCase):
+    """TestCustomLogger class"""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.temp_dir.name, "test.log")
+        self.loggers = []
+
+    def tearDown(self):
+        for logger in self.loggers:
+            logger.close()
+        self.temp_dir.cleanup()
+
+    def new_logger(self, **kwargs):
+        logger = CustomLogger(self.log_file, logging.DEBUG, **kwargs)
+        self.loggers.append(logger)
+        return logger
+
+    def read(self):
+        with open(self.log_file, encoding="utf-8") as file:
+            return file.read().splitlines()
+
+    def test_lazy_arguments(self):
+        class Expensive:
+            formatted = 0
+            def __str__(self):
+                Expensive.formatted += 1
+                return "expensive"
+        logger = self.new_logger()
+        logger.log_debug("Dropped %s", Expensive())
+        self.assertEqual(Expensive.formatted, 0)
+        logger.log_info("Kept %s", Expensive())
+        self.assertTrue(self.read()[0].endswith("INFO - Kept expensive"))
+
+    def test_queued(self):
+        logger = self.new_logger(queued=True)
+        for i in range(1000):
+            logger.log_info("Record %d", i)
+        logger.close()
+        lines = self.read()
+        self.assertEqual(len(lines), 1000)
+        self.assertTrue(lines[-1].endswith("Record 999"))
+
+    def test_json_and_rotation(self):
+        logger = self.new_logger(queued=True, json_format=True, max_bytes=2000, backup_count=2)
+        for i in range(100):
+            logger.log_warning("Record %d", i)
+        logger.close()
+        entry = json.loads(self.read()[-1])
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["message"], "Record 99")
+        self.assertLessEqual(os.path.getsize(self.log_file), 2000)
+        self.assertTrue(os.path.exists(self.log_file + ".2"))
+        self.assertFalse(os.path.exists(self.log_file + ".3"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,23 +5,47 @@ import base64
 
 import binascii
 import sys
-import logging
 
-# Import the created classes
+# Import the created classes, the database, crypto and server modules are
+# imported when an action needs them so --help and client runs start fast
 from config import TableConfig
-from db import DatabaseManager
-from encrypt import DatabaseEncryptor
-from log import CustomLogger
-
-from Crypto.Cipher import AES
+from metrics import METRICS, span
+from transfer import import_file, export_file, delete_file, FORMATS
 
 CONFIG_FILE="config.json"
-AES_KEY_LENGTH = AES.key_size # AES key length in bytes (for AES-256)
-
-EMD5="emd5"
-PMD5="pmd5"
+AES_KEY_LENGTH = 32 # AES key length in bytes (for AES-256)
+
+READ_ONLY_ACTIONS=('list', 'export')
+# Actions a running server can take over
+SERVER_ACTIONS=('add', 'delete', 'list')
+SOCKET="socket"
+POOL_SIZE="pool_size"
+FLUSH_INTERVAL="flush_interval"
+SHARD_KEY="shard_key"
 LOG_FILE="db.log"
-logger = CustomLogger(LOG_FILE, logging.DEBUG)
+# Size at which db.log is rotated
+LOG_MAX_BYTES=10 * 1024 * 1024
+
+class LazyLogger:
+    """Creates the CustomLogger, and opens the log file, on first use"""
+    def __init__(self):
+        self._logger = None
+
+    def __getattr__(self, name):
+        if self._logger is None:
+            import logging  # pylint: disable=import-outside-toplevel
+            from log import CustomLogger  # pylint: disable=import-outside-toplevel
+            self._logger = CustomLogger(LOG_FILE, logging.DEBUG, queued=True,
+                                        max_bytes=LOG_MAX_BYTES)
+        return getattr(self._logger, name)
+
+    def log_debug(self, message, *args):
+        # Debug records are below the level of the file, they are not worth
+        # opening it for
+        if self._logger is not None:
+            self._logger.log_debug(message, *args)
+
+logger = LazyLogger()
 
 def generate_encoded_key():
     """generate encoded key
@@ -31,17 +55,19 @@ def generate_encoded_key():
     return base64.b64encode(os.urandom(AES_KEY_LENGTH)).decode('utf-8')
 
 def display_records(rows):
-    """Displays the records read from the Database
+    """Displays the records read from the Database as they arrive
 
     Args:
-        rows: Information that was read
+        rows: Information that was read, any iterable
     """
-    if not rows:
+    found = False
+    for row in rows:
+        if not found:
+            print("Records:")
+            found = True
+        print(row)
+    if not found:
         print("No records found.")
-    else:
-        print("Records:")
-        for row in rows:
-            print(row)
 
 def parser_initializer(parser):
     """Initializes parser params
@@ -49,11 +75,26 @@ def parser_initializer(parser):
     Args:
         parser: Arg parser initialization
     """
-    parser.add_argument('--action', choices=['menu', 'add', 'delete', 'list'],
-                        default='menu', help='Choose action mode: menu, add, delete, list')
+    parser.add_argument('--action',
+                        choices=['menu', 'add', 'delete', 'list', 'serve', 'import', 'export'],
+                        default='menu',
+                        help='Choose action mode: menu, add, delete, list, serve, import, export')
     parser.add_argument('--name', help='Name for adding a record')
     parser.add_argument('--email', help='Email for adding/deleting a record')
     parser.add_argument('--all', action='store_true', help='Delete all records')
+    parser.add_argument('--limit', type=int, help='List at most this many records')
+    parser.add_argument('--after', type=int, help='List the records after this id')
+    parser.add_argument('--name-prefix', help='List the records whose name starts with it')
+    parser.add_argument('--email-prefix', help='List the records whose email starts with it')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print how long each phase took')
+    parser.add_argument('--metrics',
+                        help='Write the timings to this file, Prometheus text for *.prom, '
+                             'JSON lines otherwise')
+    parser.add_argument('--file',
+                        help='CSV or JSON lines file to import/export, or whose emails to delete')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='Format of --file, guessed from the extension by default')
     return parser.parse_args()
 
 def check_config():
@@ -63,6 +104,69 @@ def check_config():
         logger.log_error("Config file is absent")
         sys.exit(1)
 
+def build_request(args):
+    """Turns the command line arguments into a server request"""
+    return {"action": args.action, "name": args.name, "email": args.email, "all": args.all,
+            "limit": args.limit, "after": args.after, "name_prefix": args.name_prefix,
+            "email_prefix": args.email_prefix}
+
+def display_response(response):
+    """Displays the outcome of an action"""
+    if "rows" in response:
+        display_records(response["rows"])
+        if response.get("next") is not None:
+            print(f"More records may follow, continue with --after {response['next']}")
+    else:
+        print(response["message"])
+
+def serve(table_config, session, table_name):
+    """Serves the CLI actions over a Unix socket until interrupted"""
+    # pylint: disable=import-outside-toplevel
+    import signal
+    import threading
+    from server import DatabaseServer, DEFAULT_SOCKET, DEFAULT_POOL_SIZE, DEFAULT_FLUSH_INTERVAL
+
+    socket_path = table_config.get(SOCKET) or DEFAULT_SOCKET
+    server = DatabaseServer(socket_path, session.working_copy, table_name, session.checkpoint,
+                            pool_size=table_config.get(POOL_SIZE) or DEFAULT_POOL_SIZE,
+                            flush_interval=table_config.get(FLUSH_INTERVAL)
+                            or DEFAULT_FLUSH_INTERVAL)
+    # shutdown() blocks until serve_forever() returns, so not from the handler
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logger.log_info("Serving %s on %s", table_name, socket_path)
+    print(f"Serving on {socket_path}, Ctrl+C to stop")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    logger.log_info("Server stopped")
+
+def display_progress(rows, rows_per_second):
+    """Displays the progress of an import or export"""
+    print(f"{rows} rows, {rows_per_second:.0f} rows/s", file=sys.stderr)
+
+def transfer(args, db_manager, table_name):
+    """Runs the import and export actions and deletes from a file"""
+    if not args.file:
+        print("Please provide a --file.")
+        return
+    try:
+        if args.action == 'delete':
+            count = delete_file(db_manager, table_name, args.file, args.format)
+            print(f"Deleted {count} records.")
+        elif args.action == 'import':
+            count = import_file(db_manager, table_name, args.file, args.format,
+                                report=display_progress)
+            print(f"Imported {count} records.")
+        else:
+            count = export_file(db_manager, table_name, args.file, args.format,
+                                report=display_progress)
+            print(f"Exported {count} records.")
+    except (OSError, ValueError, KeyError) as error:
+        logger.log_error("%s of %s failed: %r", args.action, args.file, error)
+        print(f"Could not {args.action} {args.file}: {error!r}")
+
 def menu():
     """Displays menu"""
     print("\nMenu:")
@@ -73,23 +177,71 @@ def menu():
     return input("Enter your choice (1-4): ")
 
 
+def report_metrics(args):
+    """Prints and exports the timings collected during the run"""
+    if args.profile:
+        print(METRICS.report(), file=sys.stderr)
+    if args.metrics:
+        METRICS.write(args.metrics)
+
 def main():
     """main function"""
     logger.log_debug("main: execution begins")
 
     parser = argparse.ArgumentParser(description='Database Operations')
     args = parser_initializer(parser)
+    try:
+        with span("main.total"):
+            run(args)
+    finally:
+        report_metrics(args)
 
-    logger.log_info(f"main: config file is present: {CONFIG_FILE}")
+def prepare_table(db_manager, session, database_config):
+    """Creates the table of a new database, or brings the indexes of an
+    existing one in line with the config
+
+    Returns:
+        True when the database was changed
+    """
+    table_name = database_config.get("table_name")
+    columns = database_config.get_columns()
+    indexes = database_config.get_indexes()
+    if session.fresh:
+        db_manager.create_table(table_name, columns, indexes)
+        return False
+    db_manager.register_table(table_name, columns)
+    # Indexes added to the config since the database was created, the
+    # statements are derived once per version of config.json
+    wanted = database_config.derived(
+        "index_statements",
+        lambda: db_manager.index_statements(table_name, columns, indexes))
+    if db_manager.create_indexes(table_name, columns, indexes, wanted) > 0:
+        logger.log_info("Updated the indexes of %s", table_name)
+        return True
+    return False
+
+def run(args):
+    """Runs the action selected on the command line"""
+    from server import run_action, send_request, DEFAULT_SOCKET  # pylint: disable=import-outside-toplevel
+    logger.log_info("main: config file is present: %s", CONFIG_FILE)
 
     table_config = TableConfig(CONFIG_FILE)
     table_name = table_config.get("table_name")
     database_name = table_config.get("database_name")
     encryption_key = table_config.get("encryption_key")
 
-    logger.log_debug(f"Table: {table_name} Databse: {database_name} Key: {encryption_key}")
+    socket_path = table_config.get(SOCKET) or DEFAULT_SOCKET
+    if args.action in SERVER_ACTIONS and not args.file and os.path.exists(socket_path):
+        # A server owns the database, let it run the action
+        try:
+            display_response(send_request(socket_path, build_request(args)))
+            return
+        except OSError:
+            logger.log_warning("No server listening on %s, running locally", socket_path)
+
+    logger.log_debug("Table: %s Database: %s", table_name, database_name)
 
-    if database_name:
+    if database_name or table_config.get("shards"):
         logger.log_debug("Database file operations in progress")
 
         if not encryption_key:
@@ -110,106 +262,114 @@ def main():
             logger.log_error(" Not B64 encoded key")
             sys.exit(1)
 
-        # Create DatabaseEncryption instance
-        db_encryption = DatabaseEncryptor(encryption_key)
-        db_encryption.set_logger(logger)
-        # Database file. database_name is the name of the file
-        if os.path.exists(database_name):
-            logger.log_debug(f"File {database_name} exists")
-
-            # Decrypt the database file (Example: For verification purposes)
-            database_name, plainmd5, encryptedmd5 = db_encryption.decrypt_database(database_name)
-            if len(table_config.get(EMD5)) > 0:
-                if encryptedmd5 != table_config.get(EMD5):
-                    logger.log_debug("The checksum failed for the encrypted file")
-                    sys.exit(2)
-                logger.log_info(f"Checksum verification success {encryptedmd5}")
-
-            logger.log_debug("Decrypted {database_name}, Digest: {plainmd5}")
-
-            # create_encrypted_database(database_name, encryption_key)
-            db_manager = DatabaseManager(database_name)
+        # Create a DatabaseSession for the database, or one per shard
+        # pylint: disable=import-outside-toplevel
+        from db import DatabaseManager, ResultCache
+        from session import DatabaseSession, ChecksumError
+        shards = table_config.get_shards()
+        database_configs = shards or [table_config]
+        try:
+            sessions = [DatabaseSession(database_config, encryption_key)
+                        for database_config in database_configs]
+        except ValueError as error:
+            logger.log_error("Invalid encryption settings: %s", error)
+            sys.exit(1)
+        opened = []
+        try:
+            with span("main.open"):
+                for session in sessions:
+                    session.set_logger(logger)
+                    session.open()
+                    opened.append(session)
+        except ChecksumError:
+            for session in opened:
+                session.close(read_only=True)
+            sys.exit(2)
+
+        managers = []
+        migrated = False
+        for session, database_config in zip(sessions, database_configs):
+            # Shards are read from several threads at once. The menu lists
+            # the records again and again, mostly unchanged in between
+            manager = DatabaseManager(session.working_copy, check_same_thread=not shards,
+                                      result_cache=ResultCache() if args.action == 'menu'
+                                      else None)
+            session.attach(manager.conn)
+            managers.append(manager)
+            migrated = prepare_table(manager, session, database_config) or migrated
+        if shards:
+            from shards import ShardRegistry, DEFAULT_SHARD_KEY
+            db_manager = ShardRegistry(
+                table_name, [(manager, database_config.get("table_name"))
+                             for manager, database_config in zip(managers, database_configs)],
+                table_config.get(SHARD_KEY) or DEFAULT_SHARD_KEY)
         else:
-            # It is running a fresh instance
-            logger.log_debug("Running DB setup.")
-            db_manager = DatabaseManager(database_name)
-            columns = table_config.get_columns()
-            db_manager.create_table(table_name, columns)
+            db_manager = managers[0]
+        session = sessions[0]
     else:
         print("Database Name is must have. (Full path) ")
         sys.exit(1)
 
-    if args.action == 'menu':
-        while True:
-            choice = menu()
-
-            if choice == '1':
-                name = input("Enter name: ")
-                email = input("Enter email: ")
-                db_manager.insert_data_unique(table_name, [(name, email)])
-                print("Record added successfully!")
+    with span("main.action"):
+        if args.action == 'menu':
+            # Records added in a row share one commit
+            write_buffer = db_manager.write_buffer(table_name)
+            while True:
+                choice = menu()
+
+                if choice == '1':
+                    name = input("Enter name: ")
+                    email = input("Enter email: ")
+                    write_buffer.insert((name, email))
+                    print("Record added successfully!")
+
+                elif choice == '2':
+                    write_buffer.flush()
+                    email_to_delete = input("Enter email to delete: ")
+                    if db_manager.delete_many(table_name, [email_to_delete]) == 0:
+                        print("Record not found.")
+                    else:
+                        print("Record deleted successfully!")
+
+                elif choice == '3':
+                    write_buffer.flush()
+                    display_records(db_manager.iter_rows(table_name))
+
+                elif choice == '4':
+                    write_buffer.flush()
+                    logger.log_debug("Wrote %d rows in %d commits, %.0f rows/s",
+                                     write_buffer.rows_written, write_buffer.commits,
+                                     write_buffer.rows_per_second())
+                    for manager in managers:
+                        logger.log_debug("Result cache: %s", manager.cache_stats())
+                    break
 
-            elif choice == '2':
-                email_to_delete = input("Enter email to delete: ")
-                delete_query = f"DELETE FROM {table_name} WHERE email = ?"
-                db_manager.cursor.execute(delete_query, (email_to_delete,))
-
-                if db_manager.cursor.rowcount == 0:
-                    print("Record not found.")
                 else:
-                    db_manager.conn.commit()
-                    print("Record deleted successfully!")
-
-            elif choice == '3':
-                rows = db_manager.fetch_data(table_name)
-                display_records(rows)
-
-            elif choice == '4':
-                break
+                    print("Invalid choice. Please enter a valid option.")
 
+        elif args.action == 'serve':
+            if len(sessions) > 1:
+                print("The server needs a single database, not shards.")
+            elif session.in_memory:
+                print("The server needs a database file, not in-memory storage.")
             else:
-                print("Invalid choice. Please enter a valid option.")
+                serve(table_config, session, table_name)
 
-    elif args.action == 'add':
-        if args.name and args.email:
-            db_manager.insert_data_unique(table_name, [(args.name, args.email)])
-            print("Record added successfully!")
-        else:
-            print("Please provide both name and email.")
-
-    elif args.action == 'delete':
-        if args.all:
-            delete_query = f"DELETE FROM {table_name}"
-            db_manager.cursor.execute(delete_query)
-            db_manager.conn.commit()
-            print("All records deleted successfully!")
-        elif args.email:
-            delete_query = f"DELETE FROM {table_name} WHERE email = ?"
-            db_manager.cursor.execute(delete_query, (args.email,))
-            if db_manager.cursor.rowcount == 0:
-                print("Record not found.")
-            else:
-                db_manager.conn.commit()
-                print("Record deleted successfully!")
-        else:
-            print("Please provide an email or use --all for deletion.")
+        elif args.action in ('import', 'export') or (args.action == 'delete' and args.file):
+            transfer(args, db_manager, table_name)
 
-    elif args.action == 'list':
-        rows = db_manager.fetch_data(table_name)
-        display_records(rows)
+        else:
+            display_response(run_action(db_manager, table_name, build_request(args), stream=True))
 
+    for session in sessions:
+        session.detach()
     db_manager.close_connection()
 
     # Now encrypt before exiting
     logger.log_debug("Encrypt file")
-
-    # # Encrypt the database file
-    database_name, encryptedmd5, pmd5 = db_encryption.encrypt_database(database_name)
-    logger.log_debug(f"Database file: {database_name} encrypted MD5: {encryptedmd5}")
-
-    table_config.set(EMD5, encryptedmd5)
-    table_config.set(PMD5, pmd5)
-    table_config.overwrite()
+    with span("main.close"):
+        for session in sessions:
+            session.close(read_only=args.action in READ_ONLY_ACTIONS and not migrated)
 
 
 if __name__ == "__main__":
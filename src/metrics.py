@@ -0,0 +1,138 @@
+"""Timing spans and counters for the hot paths
+
+Spans aggregate their count and duration by name, nothing is kept per
+call. The module level functions record into a process wide registry:
+
+    with span("encrypt.encrypt_database"):
+        ...
+
+    @timed("db.fetch_data")
+    def fetch_data(...):
+"""
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+JSON_LINES = "jsonl"
+PROMETHEUS = "prometheus"
+
+class SpanStats:
+    """Aggregated durations of one span, in seconds"""
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+class Metrics:
+    """Registry of spans and counters, safe to use from several threads"""
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """Adds one duration to the span name"""
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name):
+        """Times the block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator timing every call of the function"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    #################################################
+
+    def to_json_lines(self):
+        """One JSON object per span and counter"""
+        with self._lock:
+            lines = [json.dumps({"span": name, "count": stats.count, "total": stats.total,
+                                 "min": stats.min, "max": stats.max})
+                     for name, stats in self.spans.items()]
+            lines += [json.dumps({"counter": name, "value": value})
+                      for name, value in self.counters.items()]
+        return "".join(line + "\n" for line in lines)
+
+    def to_prometheus(self, prefix="pydb"):
+        """Prometheus text exposition format, spans become summaries"""
+        lines = []
+        with self._lock:
+            if self.spans:
+                lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, stats in self.spans.items():
+                labels = f'{{span="{name}"}}'
+                lines.append(f"{prefix}_span_seconds_count{labels} {stats.count}")
+                lines.append(f"{prefix}_span_seconds_sum{labels} {stats.total:.9f}")
+            for name, value in self.counters.items():
+                metric = prefix + "_" + name.replace(".", "_").replace("-", "_")
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, file_path, output_format=None):
+        """Writes the metrics, as Prometheus text for *.prom files and JSON
+        lines otherwise"""
+        if output_format is None:
+            output_format = PROMETHEUS if file_path.endswith(".prom") else JSON_LINES
+        text = self.to_prometheus() if output_format == PROMETHEUS else self.to_json_lines()
+        with open(file_path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+    def report(self):
+        """Per span breakdown for humans, slowest first"""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: item[1].total, reverse=True)
+            counters = sorted(self.counters.items())
+        lines = [f"{'span':<32} {'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+        for name, stats in spans:
+            lines.append(f"{name:<32} {stats.count:>7} {stats.total * 1000:>10.2f} "
+                         f"{stats.total / stats.count * 1000:>9.3f} {stats.max * 1000:>9.3f}")
+        for name, value in counters:
+            lines.append(f"{name:<32} {value:>7}")
+        return "\n".join(lines)
+
+METRICS = Metrics()
+span = METRICS.span
+timed = METRICS.timed
+increment = METRICS.increment
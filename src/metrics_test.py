@@ -0,0 +1,63 @@
+"""Unit test for the timing spans"""
+import json
+import os
+import tempfile
+import unittest
+
+from metrics import Metrics, METRICS
+
+class TestMetrics(unittest.TestCase):
+    """TestMetrics class"""
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_span_and_timed(self):
+        with self.metrics.span("block"):
+            pass
+        with self.assertRaises(KeyError):
+            with self.metrics.span("block"):
+                raise KeyError()
+
+        @self.metrics.timed("function")
+        def function(value):
+            return value * 2
+
+        self.assertEqual(function(2), 4)
+        self.assertEqual(function.__name__, "function")
+        self.assertEqual(self.metrics.spans["block"].count, 2)
+        self.assertEqual(self.metrics.spans["function"].count, 1)
+        self.assertLessEqual(self.metrics.spans["block"].min, self.metrics.spans["block"].max)
+
+    def test_exports(self):
+        self.metrics.record("db.fetch_data", 0.5)
+        self.metrics.record("db.fetch_data", 1.5)
+        self.metrics.increment("rows")
+        lines = [json.loads(line) for line in self.metrics.to_json_lines().splitlines()]
+        self.assertEqual(lines, [{"span": "db.fetch_data", "count": 2, "total": 2.0,
+                                  "min": 0.5, "max": 1.5},
+                                 {"counter": "rows", "value": 1}])
+        text = self.metrics.to_prometheus()
+        self.assertIn('pydb_span_seconds_count{span="db.fetch_data"} 2', text)
+        self.assertIn('pydb_span_seconds_sum{span="db.fetch_data"} 2.000000000', text)
+        self.assertIn("pydb_rows 1", text)
+        self.assertIn("db.fetch_data", self.metrics.report())
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "metrics.prom")
+            self.metrics.write(path)
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(file.read(), text)
+
+    def test_instrumented_methods(self):
+        from db import DatabaseManager  # pylint: disable=import-outside-toplevel
+        METRICS.reset()
+        db_manager = DatabaseManager(":memory:")
+        db_manager.create_table("users", [{"name": "name", "type": "TEXT"},
+                                          {"name": "email", "type": "TEXT"}])
+        db_manager.fetch_data("users")
+        db_manager.close_connection()
+        self.assertIn("db.create_table", METRICS.spans)
+        self.assertEqual(METRICS.spans["db.fetch_data"].count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,306 @@
+"""Page granular encrypted storage
+
+The file starts with a small header followed by fixed size page records.
+Every record carries its own nonce and authentication tag so a single page
+can be decrypted, verified or rewritten without touching the rest of the
+file.
+"""
+import os
+import struct
+import hashlib
+from collections import OrderedDict
+
+from Crypto.Cipher import AES
+
+try:
+    import apsw
+except ImportError:
+    apsw = None
+
+MAGIC = b"PYDBPAGE"
+VERSION = 1
+# magic, version, page size, plain text length
+HEADER = struct.Struct(">8sIIQ")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+DEFAULT_PAGE_SIZE = 4096
+DEFAULT_CACHE_PAGES = 256
+
+
+def is_page_file(file_path):
+    """Checks if file_path is stored in the paged format"""
+    try:
+        with open(file_path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+class EncryptedPageFile:
+    """File made of independently encrypted pages
+
+    Pages are decrypted on first access and kept in a small LRU cache.
+    Writes only touch the cached plain text, flush() encrypts the dirty
+    pages with a fresh nonce and writes them back.
+    """
+    def __init__(self, file_path, key, page_size=DEFAULT_PAGE_SIZE,
+                 cache_pages=DEFAULT_CACHE_PAGES):
+        self.file_path = file_path
+        self.key = key
+        self.cache_pages = cache_pages
+        self.pages_decrypted = 0
+        self.pages_encrypted = 0
+        self._pages = OrderedDict()
+        self._dirty = set()
+        self._exported = None
+
+        mode = 'r+b' if os.path.exists(file_path) else 'w+b'
+        self.file = open(file_path, mode)
+        header = self.file.read(HEADER.size)
+        if header:
+            if len(header) != HEADER.size:
+                raise ValueError("Truncated page file header")
+            magic, version, self.page_size, self.length = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a paged database file")
+        else:
+            self.page_size = page_size
+            self.length = 0
+        self._header_dirty = not header
+        self._stored_pages = self.page_count()
+        self.record_size = NONCE_SIZE + self.page_size + TAG_SIZE
+
+    def page_count(self, length=None):
+        """Number of pages needed to hold length bytes"""
+        length = self.length if length is None else length
+        return (length + self.page_size - 1) // self.page_size
+
+    def _record_offset(self, page_no):
+        return HEADER.size + page_no * self.record_size
+
+    def _decrypt_page(self, page_no):
+        self.file.seek(self._record_offset(page_no))
+        record = self.file.read(self.record_size)
+        if len(record) != self.record_size:
+            raise ValueError(f"Page {page_no} is truncated")
+        nonce = record[:NONCE_SIZE]
+        tag = record[-TAG_SIZE:]
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(struct.pack(">Q", page_no))
+        self.pages_decrypted += 1
+        return bytearray(cipher.decrypt_and_verify(record[NONCE_SIZE:-TAG_SIZE], tag))
+
+    def _encrypt_page(self, page_no, data):
+        nonce = os.urandom(NONCE_SIZE)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(struct.pack(">Q", page_no))
+        ciphertext, tag = cipher.encrypt_and_digest(bytes(data))
+        self.pages_encrypted += 1
+        return nonce + ciphertext + tag
+
+    def _page(self, page_no):
+        """Returns the plain text of a page, decrypting it on a cache miss"""
+        page = self._pages.get(page_no)
+        if page is not None:
+            self._pages.move_to_end(page_no)
+            return page
+        if page_no < self._stored_pages:
+            page = self._decrypt_page(page_no)
+        else:
+            page = bytearray(self.page_size)
+        self._pages[page_no] = page
+        self._evict()
+        return page
+
+    def _evict(self):
+        if len(self._pages) <= self.cache_pages:
+            return
+        for page_no in list(self._pages):
+            if len(self._pages) <= self.cache_pages:
+                break
+            if page_no not in self._dirty:
+                del self._pages[page_no]
+
+    def read(self, offset, size):
+        """Reads size bytes at offset, short reads past the end"""
+        end = min(offset + size, self.length)
+        result = bytearray()
+        while offset < end:
+            page_no, start = divmod(offset, self.page_size)
+            count = min(self.page_size - start, end - offset)
+            result += self._page(page_no)[start:start + count]
+            offset += count
+        return bytes(result)
+
+    def write(self, offset, data):
+        """Writes data at offset, growing the file when needed"""
+        # Pages between the current end and offset must exist on disk
+        # as valid records, so they are marked dirty as well
+        for page_no in range(self.page_count(), offset // self.page_size):
+            self._page(page_no)
+            self._dirty.add(page_no)
+        view = memoryview(data)
+        position = offset
+        while view:
+            page_no, start = divmod(position, self.page_size)
+            count = min(self.page_size - start, len(view))
+            self._page(page_no)[start:start + count] = view[:count]
+            self._dirty.add(page_no)
+            view = view[count:]
+            position += count
+        if position > self.length:
+            self.length = position
+            self._header_dirty = True
+
+    def truncate(self, size):
+        """Shrinks or grows the file to size bytes"""
+        if size < self.length:
+            page_no, start = divmod(size, self.page_size)
+            if start:
+                page = self._page(page_no)
+                page[start:] = bytes(self.page_size - start)
+                self._dirty.add(page_no)
+            for cached in [p for p in self._pages if p >= self.page_count(size)]:
+                del self._pages[cached]
+                self._dirty.discard(cached)
+            self._stored_pages = min(self._stored_pages, self.page_count(size))
+            self.length = size
+            self._header_dirty = True
+        elif size > self.length:
+            self.write(size - 1, b'\0')
+
+    def flush(self):
+        """Encrypts and writes the dirty pages
+
+        Returns:
+            Number of pages written
+        """
+        written = 0
+        for page_no in sorted(self._dirty):
+            self.file.seek(self._record_offset(page_no))
+            self.file.write(self._encrypt_page(page_no, self._pages[page_no]))
+            written += 1
+        self._dirty.clear()
+        self._evict()
+        if self._header_dirty or self._stored_pages != self.page_count():
+            self.file.seek(0)
+            self.file.write(HEADER.pack(MAGIC, VERSION, self.page_size, self.length))
+            self.file.truncate(self._record_offset(self.page_count()))
+            self._header_dirty = False
+        self._stored_pages = self.page_count()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return written
+
+    def close(self):
+        """Flushes pending pages and closes the file"""
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    #################################################
+    def _page_digest(self, data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def export_plain(self, output_file):
+        """Decrypts every page into a plain file usable by sqlite3
+
+        The digest of each page is remembered so import_plain() can
+        re-encrypt only the pages that changed.
+        """
+        digests = []
+        with open(output_file, 'wb') as file:
+            for page_no in range(self.page_count()):
+                data = self._page(page_no)
+                digests.append(self._page_digest(data))
+                file.write(data[:min(self.page_size, self.length - page_no * self.page_size)])
+        self._exported = digests
+        return output_file
+
+    def import_plain(self, input_file):
+        """Copies the pages of a plain file that changed since the last
+        export_plain() or import_plain()
+
+        Returns:
+            Number of pages written
+        """
+        exported = self._exported or []
+        digests = []
+        size = os.path.getsize(input_file)
+        if size < self.length:
+            self.truncate(size)
+        with open(input_file, 'rb') as file:
+            for page_no in range(self.page_count(size)):
+                data = file.read(self.page_size)
+                digests.append(self._page_digest(data.ljust(self.page_size, b'\0')))
+                if page_no < len(exported) and exported[page_no] == digests[-1]:
+                    continue
+                self.write(page_no * self.page_size, data)
+        self._exported = digests
+        return self.flush()
+
+
+if apsw is not None:
+    class EncryptedVFSFile:
+        """apsw file object backed by an EncryptedPageFile"""
+        def __init__(self, page_file, delete_on_close):
+            self.page_file = page_file
+            self.delete_on_close = delete_on_close
+
+        def xRead(self, amount, offset):
+            return self.page_file.read(offset, amount)
+
+        def xWrite(self, data, offset):
+            self.page_file.write(offset, data)
+
+        def xTruncate(self, newsize):
+            self.page_file.truncate(newsize)
+
+        def xSync(self, flags):
+            self.page_file.flush()
+
+        def xFileSize(self):
+            return self.page_file.length
+
+        def xLock(self, level):
+            pass
+
+        def xUnlock(self, level):
+            pass
+
+        def xCheckReservedLock(self):
+            return False
+
+        def xFileControl(self, op, ptr):
+            return False
+
+        def xSectorSize(self):
+            return self.page_file.page_size
+
+        def xDeviceCharacteristics(self):
+            return 0
+
+        def xClose(self):
+            self.page_file.close()
+            if self.delete_on_close:
+                os.remove(self.page_file.file_path)
+
+    class EncryptedVFS(apsw.VFS):
+        """apsw VFS storing the database and its journals as encrypted pages
+
+        Only the pages SQLite reads are decrypted and only the pages it
+        writes are encrypted again when it syncs. Locking is not
+        implemented, a database must only be opened by one process.
+        """
+        def __init__(self, key, name="pydb-encrypted", page_size=DEFAULT_PAGE_SIZE):
+            self.key = key
+            self.page_size = page_size
+            self.name = name
+            super().__init__(name, "")
+
+        def xOpen(self, name, flags):
+            if name is None:
+                return super().xOpen(name, flags)
+            file_path = name.filename() if isinstance(name, apsw.URIFilename) else name
+            page_file = EncryptedPageFile(file_path, self.key, self.page_size)
+            return EncryptedVFSFile(page_file, bool(flags[0] & apsw.SQLITE_OPEN_DELETEONCLOSE))
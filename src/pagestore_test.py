@@ -0,0 +1,138 @@
+"""Unit test for the page encrypted storage"""
+import os
+import tempfile
+import unittest
+
+from pagestore import EncryptedPageFile, is_page_file, apsw
+
+class TestEncryptedPageFile(unittest.TestCase):
+    """TestEncryptedPageFile class"""
+    def setUp(self):
+        self.test_key = b'test_key_16bytes'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.page_path = os.path.join(self.temp_dir.name, 'test.db.enc')
+        self.plain_path = os.path.join(self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _open(self):
+        return EncryptedPageFile(self.page_path, self.test_key, page_size=64)
+
+    def test_round_trip(self):
+        data = os.urandom(1000)
+        page_file = self._open()
+        page_file.write(0, data)
+        page_file.close()
+
+        self.assertTrue(is_page_file(self.page_path))
+        page_file = self._open()
+        self.assertEqual(page_file.read(0, 2000), data)
+        page_file.close()
+
+    def test_read_decrypts_only_touched_pages(self):
+        page_file = self._open()
+        page_file.write(0, os.urandom(64 * 10))
+        page_file.close()
+
+        page_file = self._open()
+        page_file.read(130, 10)
+        self.assertEqual(page_file.pages_decrypted, 1)
+        page_file.close()
+
+    def test_flush_writes_only_dirty_pages(self):
+        page_file = self._open()
+        page_file.write(0, os.urandom(64 * 10))
+        self.assertEqual(page_file.flush(), 10)
+
+        page_file.write(70, b'changed')
+        self.assertEqual(page_file.flush(), 1)
+        page_file.close()
+
+    def test_write_past_end_fills_gap(self):
+        page_file = self._open()
+        page_file.write(200, b'tail')
+        page_file.close()
+
+        page_file = self._open()
+        self.assertEqual(page_file.read(0, 204), bytes(200) + b'tail')
+        page_file.close()
+
+    def test_truncate(self):
+        page_file = self._open()
+        page_file.write(0, b'x' * 200)
+        page_file.truncate(100)
+        page_file.close()
+
+        page_file = self._open()
+        self.assertEqual(page_file.length, 100)
+        page_file.truncate(150)
+        self.assertEqual(page_file.read(0, 200), b'x' * 100 + bytes(50))
+        page_file.close()
+
+    def test_tampered_page_is_rejected(self):
+        page_file = self._open()
+        page_file.write(0, b'x' * 200)
+        page_file.close()
+
+        with open(self.page_path, 'r+b') as file:
+            file.seek(-20, os.SEEK_END)
+            file.write(b'\xff')
+
+        page_file = self._open()
+        with self.assertRaises(ValueError):
+            page_file.read(190, 10)
+
+    def test_not_a_page_file(self):
+        with open(self.page_path, 'wb') as file:
+            file.write(b'SQLite format 3\0' * 4)
+        self.assertFalse(is_page_file(self.page_path))
+        with self.assertRaises(ValueError):
+            self._open()
+
+    def test_import_plain_rewrites_changed_pages(self):
+        page_file = self._open()
+        page_file.write(0, os.urandom(64 * 10))
+        page_file.close()
+
+        page_file = self._open()
+        page_file.export_plain(self.plain_path)
+        with open(self.plain_path, 'r+b') as file:
+            file.seek(300)
+            file.write(b'changed')
+            file.seek(0, os.SEEK_END)
+            file.write(b'appended')
+        self.assertEqual(page_file.import_plain(self.plain_path), 2)
+        page_file.close()
+
+        with open(self.plain_path, 'rb') as file:
+            expected = file.read()
+        page_file = self._open()
+        self.assertEqual(page_file.read(0, 1000), expected)
+        page_file.close()
+
+@unittest.skipIf(apsw is None, "apsw is not installed")
+class TestEncryptedVFS(unittest.TestCase):
+    """TestEncryptedVFS class"""
+    def test_database_round_trip(self):
+        from pagestore import EncryptedVFS
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'vfs.db.enc')
+            vfs = EncryptedVFS(b'test_key_16bytes', name="pydb-test")
+            try:
+                conn = apsw.Connection(db_path, vfs=vfs.name)
+                conn.execute("CREATE TABLE users (name TEXT, email TEXT)")
+                conn.execute("INSERT INTO users VALUES ('Alice', 'alice@example.com')")
+                conn.close()
+
+                self.assertTrue(is_page_file(db_path))
+                conn = apsw.Connection(db_path, vfs=vfs.name)
+                rows = conn.execute("SELECT name, email FROM users").fetchall()
+                conn.close()
+            finally:
+                vfs.unregister()
+        self.assertEqual(rows, [('Alice', 'alice@example.com')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""Compact record classes and column arrays for the rows of a table
+
+A record class is generated from the columns of config.json. Its
+instances keep their values in __slots__, without a dict per row, and
+still unpack like the tuples sqlite returns:
+
+    User = record_class("users", ("id", "name", "email"))
+    user = User(1, "Alice", "alice@example.com")
+    user.email, tuple(user), user.as_dict()
+
+Bulk readers can take the rows column by column instead, see Columns.
+"""
+from array import array
+
+# Array type codes by sqlite column affinity, other columns are lists
+TYPECODES = {"INTEGER": "q", "REAL": "d"}
+_NUMPY = []
+
+def affinity(column_type):
+    """Sqlite type affinity of a declared column type, INTEGER, REAL, TEXT,
+    BLOB or NUMERIC"""
+    column_type = (column_type or "").upper()
+    if "INT" in column_type:
+        return "INTEGER"
+    if any(name in column_type for name in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not column_type or "BLOB" in column_type:
+        return "BLOB"
+    if any(name in column_type for name in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+def numpy_module():
+    """Returns numpy, None when it is not installed. Imported on first use,
+    it is slow to import and most runs never need it"""
+    if not _NUMPY:
+        try:
+            import numpy  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            numpy = None
+        _NUMPY.append(numpy)
+    return _NUMPY[0]
+
+class Record:
+    """Base of the generated record classes, the values are in __slots__
+    named by _fields"""
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self._fields):
+            raise TypeError(f"{type(self).__name__} takes {len(self._fields)} values, "
+                            f"got {len(values)}")
+        for field, value in zip(self._fields, values):
+            setattr(self, field, value)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, self._fields[index])
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+def record_class(table_name, fields):
+    """Generates the record class of a table
+
+    Args:
+        table_name: gives the class its name, users becomes UsersRecord
+        fields: column names, in the order of the rows
+
+    Returns:
+        subclass of Record
+    """
+    fields = tuple(fields)
+    for field in fields:
+        if not field.isidentifier() or field.startswith("_"):
+            raise ValueError(f"Column {field!r} cannot be a record field")
+    name = "".join(part.capitalize() for part in table_name.split(".")[-1].split("_"))
+    return type(name + "Record", (Record,), {"__slots__": fields, "_fields": fields})
+
+class Columns:
+    """Collects rows into one container per column
+
+    INTEGER and REAL columns go to arrays of 64 bit values, 8 bytes per
+    value instead of a Python object each. Other columns, and numeric
+    columns holding NULL or text, are lists.
+
+    Args:
+        names: column names
+        types: declared column types, as in config.json
+    """
+    def __init__(self, names, types):
+        self.names = tuple(names)
+        self.columns = []
+        for column_type in types:
+            typecode = TYPECODES.get(affinity(column_type))
+            self.columns.append(array(typecode) if typecode else [])
+
+    def extend(self, rows):
+        """Adds the rows, tuples in the order of names"""
+        rows = rows if isinstance(rows, list) else list(rows)
+        for index, values in enumerate(zip(*rows)):
+            column = self.columns[index]
+            if isinstance(column, array):
+                try:
+                    values = array(column.typecode, values)
+                except (TypeError, OverflowError):
+                    # A NULL or a value of another type, keep the column as a list
+                    column = self.columns[index] = column.tolist()
+            column.extend(values)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def to_dict(self, use_numpy=None):
+        """Returns the columns by name
+
+        Args:
+            use_numpy: numpy arrays instead of array.array and lists, by
+                default when numpy is installed
+
+        Raises:
+            ImportError: use_numpy is True and numpy is not installed
+        """
+        numpy = numpy_module() if use_numpy is not False else None
+        if use_numpy and numpy is None:
+            raise ImportError("numpy is not installed")
+        if numpy is None:
+            return dict(zip(self.names, self.columns))
+        converted = {}
+        for name, column in zip(self.names, self.columns):
+            if isinstance(column, array):
+                dtype = numpy.int64 if column.typecode == "q" else numpy.float64
+                converted[name] = numpy.frombuffer(column, dtype=dtype)
+            else:
+                converted[name] = numpy.array(column, dtype=object)
+        return converted
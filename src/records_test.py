@@ -0,0 +1,67 @@
+"""Unit tests for the record classes and the column arrays"""
+import unittest
+from array import array
+from records import Columns, affinity, numpy_module, record_class
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        self.record = record_class("user_accounts", ("id", "name", "email"))
+
+    def test_fields(self):
+        user = self.record(1, "Alice", "alice@example.com")
+        self.assertEqual(type(user).__name__, "UserAccountsRecord")
+        self.assertEqual((user.id, user.name, user[2]), (1, "Alice", "alice@example.com"))
+        self.assertEqual(user, (1, "Alice", "alice@example.com"))
+        self.assertEqual(user.as_dict()["email"], "alice@example.com")
+        ident, name, _ = user
+        self.assertEqual((ident, name), (1, "Alice"))
+        self.assertFalse(hasattr(user, "__dict__"))
+        with self.assertRaises(AttributeError):
+            user.age = 3
+
+    def test_wrong_number_of_values(self):
+        with self.assertRaises(TypeError):
+            self.record(1, "Alice")
+
+    def test_invalid_field(self):
+        with self.assertRaises(ValueError):
+            record_class("users", ("id", "_private"))
+
+class TestColumns(unittest.TestCase):
+    def test_affinity(self):
+        self.assertEqual([affinity(name) for name in ("BIGINT", "VARCHAR(20)", "", "DOUBLE",
+                                                      "DECIMAL")],
+                         ["INTEGER", "TEXT", "BLOB", "REAL", "NUMERIC"])
+
+    def test_arrays_and_lists(self):
+        columns = Columns(("id", "name", "score"), ("INTEGER", "TEXT", "REAL"))
+        columns.extend([(1, "a", 1.5), (2, "b", 2)])
+        result = columns.to_dict(use_numpy=False)
+        self.assertEqual(result["id"], array("q", [1, 2]))
+        self.assertEqual(result["score"], array("d", [1.5, 2.0]))
+        self.assertEqual(result["name"], ["a", "b"])
+        self.assertEqual(len(columns), 2)
+
+    def test_null_turns_the_column_into_a_list(self):
+        columns = Columns(("id", "age"), ("INTEGER", "INTEGER"))
+        columns.extend([(1, 30)])
+        columns.extend([(2, None), (3, 40)])
+        result = columns.to_dict(use_numpy=False)
+        self.assertEqual(result["age"], [30, None, 40])
+        self.assertEqual(list(result["id"]), [1, 2, 3])
+
+    @unittest.skipUnless(numpy_module(), "numpy is not installed")
+    def test_numpy(self):
+        columns = Columns(("id", "name"), ("INTEGER", "TEXT"))
+        columns.extend([(1, "a"), (2, "b")])
+        result = columns.to_dict(use_numpy=True)
+        self.assertEqual(result["id"].sum(), 3)
+        self.assertEqual(list(result["name"]), ["a", "b"])
+
+    @unittest.skipIf(numpy_module(), "numpy is installed")
+    def test_numpy_missing(self):
+        with self.assertRaises(ImportError):
+            Columns(("id",), ("INTEGER",)).to_dict(use_numpy=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+"""Daemon keeping the decrypted database open behind a Unix socket
+
+Requests and responses are JSON objects, one per line. A request carries
+the CLI action and its arguments, e.g. {"action": "add", "name": "...",
+"email": "..."}, plus the "flush", "stats" and "shutdown" control actions.
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+
+from db import DatabaseManager, ResultCache
+
+DEFAULT_SOCKET="db.sock"
+DEFAULT_POOL_SIZE = 4
+# Seconds between two encrypted snapshots of a modified database
+DEFAULT_FLUSH_INTERVAL = 30
+WRITE_ACTIONS = ('add', 'delete')
+
+def run_action(db_manager, table_name, request, stream=False):
+    """Runs one CLI action
+
+    Args:
+        db_manager: DatabaseManager to use
+        table_name: table the action applies to
+        request: dict with the action and its arguments
+        stream: return the rows of list as an iterator instead of a list
+
+    Returns:
+        dict with the message to display and, for list, the rows and the
+        cursor of the next page when limit was reached
+    """
+    action = request.get("action")
+    if action == 'add':
+        if request.get("name") and request.get("email"):
+            db_manager.upsert(table_name, [(request["name"], request["email"])])
+            return {"message": "Record added successfully!"}
+        return {"message": "Please provide both name and email."}
+
+    if action == 'delete':
+        if request.get("all"):
+            db_manager.delete_all(table_name)
+            return {"message": "All records deleted successfully!"}
+        if request.get("email"):
+            if db_manager.delete_many(table_name, [request["email"]]) == 0:
+                return {"message": "Record not found."}
+            return {"message": "Record deleted successfully!"}
+        return {"message": "Please provide an email or use --all for deletion."}
+
+    if action == 'list':
+        query = {"after": request.get("after"),
+                 "name_prefix": request.get("name_prefix"),
+                 "email_prefix": request.get("email_prefix")}
+        limit = request.get("limit")
+        if limit:
+            rows, last_key = db_manager.fetch_page(table_name, limit, **query)
+            response = {"rows": rows}
+            if len(rows) == limit:
+                response["next"] = last_key
+            return response
+        rows = db_manager.iter_rows(table_name, **query)
+        return {"rows": rows if stream else list(rows)}
+
+    raise ValueError(f"Unknown action {action}")
+
+def send_request(socket_path, request):
+    """Sends one request to a running server
+
+    Args:
+        socket_path: Unix socket of the server
+        request: dict with the action and its arguments
+
+    Returns:
+        response dict, rows are returned as tuples
+
+    Raises:
+        OSError: no server is listening on socket_path
+        RuntimeError: the server failed to run the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b"\n")
+        with client.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Server closed the connection")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    if "rows" in response:
+        response["rows"] = [tuple(row) for row in response["rows"]]
+    return response
+
+class ConnectionPool:
+    """Fixed set of DatabaseManager connections shared by the handler threads
+
+    The connections share one ResultCache, a write on any of them drops
+    the results the others cached for the table.
+    """
+    def __init__(self, db_name, size=DEFAULT_POOL_SIZE, result_cache=None):
+        self.size = size
+        self.result_cache = result_cache
+        self.managers = queue.Queue()
+        for _ in range(size):
+            self.managers.put(DatabaseManager(db_name, check_same_thread=False,
+                                              result_cache=result_cache))
+
+    @contextmanager
+    def connection(self):
+        """Borrows a DatabaseManager, waiting for one to be free"""
+        db_manager = self.managers.get()
+        try:
+            yield db_manager
+        finally:
+            self.managers.put(db_manager)
+
+    def close(self):
+        """Closes every connection once it is returned"""
+        for _ in range(self.size):
+            self.managers.get().close_connection()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Serves the requests of one client connection"""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.execute(json.loads(line))
+            except Exception as error:  # pylint: disable=broad-except
+                response = {"error": str(error)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+class DatabaseServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves CLI actions against an already decrypted database
+
+    Reads run concurrently on the pooled connections, writes are
+    serialized. flush is called with writes blocked, every flush_interval
+    seconds when something changed and on a "flush" request.
+
+    Args:
+        socket_path: Unix socket to listen on
+        db_name: plain working copy of the database
+        table_name: table the actions apply to
+        flush: callable writing an encrypted snapshot of db_name
+        result_cache: ResultCache for the list results, a new one by
+            default, False to disable it
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, db_name, table_name, flush,
+                 pool_size=DEFAULT_POOL_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 result_cache=None):
+        if os.path.exists(socket_path):
+            try:
+                send_request(socket_path, {"action": "ping"})
+            except OSError:
+                # Left behind by a server that did not shut down cleanly
+                os.remove(socket_path)
+            else:
+                raise RuntimeError(f"A server is already listening on {socket_path}")
+        super().__init__(socket_path, RequestHandler)
+        self.socket_path = socket_path
+        self.table_name = table_name
+        self.flush_callback = flush
+        self.flush_interval = flush_interval
+        if result_cache is None:
+            result_cache = ResultCache()
+        self.pool = ConnectionPool(db_name, pool_size, result_cache or None)
+        self.write_lock = threading.Lock()
+        self.dirty = False
+        self._stopped = threading.Event()
+
+    def execute(self, request):
+        """Runs one request, see run_action()"""
+        action = request.get("action")
+        if action == 'ping':
+            return {"message": "pong"}
+        if action == 'flush':
+            self.flush()
+            return {"message": "Flushed"}
+        if action == 'stats':
+            return {"message": "Result cache: " + json.dumps(
+                self.pool.result_cache.stats() if self.pool.result_cache else None)}
+        if action == 'shutdown':
+            # shutdown() waits for serve_forever(), it cannot run on its thread
+            threading.Thread(target=self.shutdown).start()
+            return {"message": "Shutting down"}
+
+        with self.pool.connection() as db_manager:
+            if action in WRITE_ACTIONS:
+                with self.write_lock:
+                    self.dirty = True
+                    return run_action(db_manager, self.table_name, request)
+            return run_action(db_manager, self.table_name, request)
+
+    def flush(self):
+        """Writes an encrypted snapshot if anything changed since the last one"""
+        with self.write_lock:
+            if self.dirty:
+                self.flush_callback()
+                self.dirty = False
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def serve(self):
+        """Serves until shutdown() is called, then closes the connections.
+        The final snapshot is left to the caller."""
+        flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        flusher.start()
+        try:
+            self.serve_forever()
+        finally:
+            self._stopped.set()
+            flusher.join()
+            self.server_close()
+            os.remove(self.socket_path)
+            self.pool.close()
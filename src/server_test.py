@@ -0,0 +1,121 @@
+"""Unit test for the database server"""
+import os
+import tempfile
+import threading
+import unittest
+
+from db import DatabaseManager
+from server import DatabaseServer, run_action, send_request
+
+class TestRunAction(unittest.TestCase):
+    """TestRunAction class"""
+    def setUp(self):
+        self.db_manager = DatabaseManager(":memory:")
+        self.db_manager.create_table("users", [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+
+    def _run(self, **request):
+        return run_action(self.db_manager, "users", request)
+
+    def test_add_list_delete(self):
+        self.assertEqual(self._run(action="add", name="Alice", email="alice@example.com"),
+                         {"message": "Record added successfully!"})
+        self.assertEqual(self._run(action="list"), {"rows": [(1, "Alice", "alice@example.com")]})
+        self.assertEqual(self._run(action="delete", email="bob@example.com"),
+                         {"message": "Record not found."})
+        self.assertEqual(self._run(action="delete", email="alice@example.com"),
+                         {"message": "Record deleted successfully!"})
+        self.assertEqual(self._run(action="list"), {"rows": []})
+
+    def test_list_pages(self):
+        for name in ("Alice", "Bob", "Carol"):
+            self._run(action="add", name=name, email=f"{name.lower()}@example.com")
+        self.assertEqual(self._run(action="list", limit=2),
+                         {"rows": [(1, "Alice", "alice@example.com"),
+                                   (2, "Bob", "bob@example.com")], "next": 2})
+        self.assertEqual(self._run(action="list", limit=2, after=2),
+                         {"rows": [(3, "Carol", "carol@example.com")]})
+        self.assertEqual(self._run(action="list", name_prefix="B"),
+                         {"rows": [(2, "Bob", "bob@example.com")]})
+
+    def test_missing_arguments(self):
+        self.assertEqual(self._run(action="add", name="Alice"),
+                         {"message": "Please provide both name and email."})
+        self.assertEqual(self._run(action="delete"),
+                         {"message": "Please provide an email or use --all for deletion."})
+
+    def test_unknown_action(self):
+        with self.assertRaises(ValueError):
+            self._run(action="drop")
+
+class TestDatabaseServer(unittest.TestCase):
+    """TestDatabaseServer class"""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.temp_dir.name, "test.db")
+        self.socket_path = os.path.join(self.temp_dir.name, "test.sock")
+        db_manager = DatabaseManager(self.db_name)
+        db_manager.create_table("users", [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT"},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+        db_manager.close_connection()
+
+        self.flushes = 0
+        self.server = DatabaseServer(self.socket_path, self.db_name, "users", self._flush,
+                                     pool_size=2, flush_interval=60)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.temp_dir.cleanup()
+
+    def _flush(self):
+        self.flushes += 1
+
+    def _send(self, **request):
+        return send_request(self.socket_path, request)
+
+    def test_requests(self):
+        self._send(action="add", name="Alice", email="alice@example.com")
+        self._send(action="add", name="Bob", email="bob@example.com")
+        rows = self._send(action="list")["rows"]
+        self.assertEqual(rows, [(1, "Alice", "alice@example.com"), (2, "Bob", "bob@example.com")])
+
+    def test_flush_only_when_modified(self):
+        self._send(action="flush")
+        self.assertEqual(self.flushes, 0)
+        self._send(action="add", name="Alice", email="alice@example.com")
+        self._send(action="flush")
+        self._send(action="flush")
+        self.assertEqual(self.flushes, 1)
+
+    def test_list_results_cached_until_written(self):
+        self._send(action="add", name="Alice", email="alice@example.com")
+        self._send(action="list", limit=10)
+        self._send(action="list", limit=10)
+        self._send(action="add", name="Bob", email="bob@example.com")
+        self.assertEqual(len(self._send(action="list", limit=10)["rows"]), 2)
+        stats = self.server.pool.result_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertIn("hit_rate", self._send(action="stats")["message"])
+
+    def test_error_response(self):
+        with self.assertRaises(RuntimeError):
+            self._send(action="drop")
+
+    def test_second_server_refused(self):
+        with self.assertRaises(RuntimeError):
+            DatabaseServer(self.socket_path, self.db_name, "users", self._flush)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+"""Lifecycle of the plain working copy of the encrypted database"""
+import os
+import sqlite3
+from contextlib import nullcontext
+
+from encrypt import DatabaseEncryptor, DEFAULT_DIGEST
+from locks import FileLock
+from pagestore import EncryptedPageFile, is_page_file
+
+EMD5="emd5"
+PMD5="pmd5"
+# Checksums computed with a digest other than MD5 are kept in their own keys
+DIGEST="digest"
+EDIGEST="edigest"
+PDIGEST="pdigest"
+# Number of threads running the cipher
+WORKERS="workers"
+# Map the files instead of streaming them
+MMAP="mmap"
+# Codec compressing the database before it is encrypted: zlib, lzma, bz2, zstd
+COMPRESSION="compression"
+STORAGE="storage"
+PAGED_STORAGE="paged"
+# Decrypt into an in-memory database, no plain text is written to disk
+MEMORY_STORAGE="memory"
+MEMORY_DATABASE=":memory:"
+# Seconds to wait for another process using the database, forever when unset
+LOCK_TIMEOUT="lock_timeout"
+# Held by the session writing the database, from decryption to write back
+WRITER_LOCK_SUFFIX=".lock"
+# Shared while a session decrypts, exclusive while the changes are written back
+DATA_LOCK_SUFFIX=".data.lock"
+
+class ChecksumError(Exception):
+    """The encrypted database does not match the recorded checksum"""
+
+class DatabaseSession:
+    """Decrypts the database into a working copy and writes the changes back
+
+    Sessions of several processes coordinate through lock files next to
+    the database. One writing session at a time holds the writer lock from
+    open() to close(). Shared sessions, for actions that only read, skip
+    it: they decrypt into a working copy of their own, waiting only while
+    a writer is writing back, and never write anything.
+
+    Args:
+        table_config: TableConfig, the checksums are stored in it
+        encryption_key: decoded key
+        shared: open the database for reading only
+    """
+    def __init__(self, table_config, encryption_key, shared=False):
+        self.table_config = table_config
+        self.shared = shared
+        self.encryption_key = encryption_key
+        self.database_name = table_config.get("database_name")
+        self.digest = table_config.get(DIGEST) or DEFAULT_DIGEST
+        # Raises ValueError for invalid settings
+        self.db_encryption = DatabaseEncryptor(encryption_key, digest=self.digest,
+                                               workers=table_config.get(WORKERS) or 1,
+                                               use_mmap=bool(table_config.get(MMAP)),
+                                               compression=table_config.get(COMPRESSION) or None)
+        if self.digest == "md5":
+            self.encrypted_key, self.plain_key = EMD5, PMD5
+        else:
+            self.encrypted_key, self.plain_key = EDIGEST, PDIGEST
+        self.paged = table_config.get(STORAGE) == PAGED_STORAGE
+        self.in_memory = table_config.get(STORAGE) == MEMORY_STORAGE
+        if self.in_memory and not hasattr(sqlite3.Connection, "deserialize"):
+            raise ValueError("In-memory storage needs Python 3.11 or later")
+        if self.in_memory:
+            self.working_copy = MEMORY_DATABASE
+        else:
+            self.working_copy = self.db_encryption.get_plain_db_name(self.database_name)
+            if shared:
+                # Several readers may decrypt at once, each into its own copy
+                self.working_copy += f".{os.getpid()}"
+        timeout = table_config.get(LOCK_TIMEOUT) or None
+        self.writer_lock = FileLock(self.database_name + WRITER_LOCK_SUFFIX, timeout)
+        self.data_lock = FileLock(self.database_name + DATA_LOCK_SUFFIX, timeout)
+        self.page_file = None
+        self.plain_data = None
+        self.connection = None
+        self.fresh = False
+        self.logger = None
+
+    def set_logger(self, logger):
+        """Sets the logger"""
+        self.logger = logger
+        self.db_encryption.set_logger(logger)
+
+    def _log_debug(self, message, *args):
+        if self.logger:
+            self.logger.log_debug(message, *args)
+
+    def _log_info(self, message, *args):
+        if self.logger:
+            self.logger.log_info(message, *args)
+
+    def open(self):
+        """Decrypts the database into the working copy
+
+        Returns:
+            path of the working copy, fresh is set when there was no database.
+            With in-memory storage it is ":memory:" and the connection
+            opened on it has to be passed to attach()
+
+        Raises:
+            ChecksumError: the encrypted file does not match config.json
+            LockTimeout: another process kept the database locked
+        """
+        if not self.shared:
+            self.writer_lock.acquire()
+        try:
+            with self.data_lock.hold(shared=True) if self.shared else nullcontext():
+                return self._open()
+        except BaseException:
+            self.writer_lock.release()
+            raise
+
+    def _open(self):
+        # The checksums may have been changed by the process that held the lock
+        self.table_config.reload()
+        self.fresh = not os.path.exists(self.database_name)
+        if self.shared and self.fresh:
+            self._log_debug("Running DB setup.")
+        elif self.paged:
+            # Pages are authenticated one by one, the file checksum is not used
+            self._open_paged()
+        elif not self.fresh:
+            self._log_debug("File %s exists", self.database_name)
+
+            if self.in_memory:
+                self.plain_data, plainmd5, encryptedmd5 = self.db_encryption.decrypt_bytes(
+                    self.database_name)
+            else:
+                # Decrypt into a working copy, the encrypted file stays in place
+                # so only the changed blocks have to be written back
+                _, plainmd5, encryptedmd5 = self.db_encryption.decrypt_database(
+                    self.database_name, self.working_copy)
+            expected = self.table_config.get(self.encrypted_key)
+            if len(expected) > 0:
+                if encryptedmd5 != expected:
+                    self._log_debug("The checksum failed for the encrypted file")
+                    self.plain_data = None
+                    if not self.in_memory:
+                        self.db_encryption.discard_working_copy(self.working_copy)
+                    raise ChecksumError(self.database_name)
+                self._log_info("Checksum verification success %s", encryptedmd5)
+            self._log_debug("Decrypted %s, Digest: %s", self.working_copy, plainmd5)
+        else:
+            self._log_debug("Running DB setup.")
+        return self.working_copy
+
+    def attach(self, connection):
+        """Prepares the connection opened on the working copy
+
+        A working copy file is switched to WAL, so the connections of a
+        server do not block each other, and its log is checkpointed before
+        every write back. The in-memory database is loaded into the
+        connection.
+        """
+        if not self.in_memory:
+            connection.execute("PRAGMA journal_mode=WAL")
+            return
+        self.connection = connection
+        if self.plain_data is not None:
+            if self.plain_data[18:20] == b"\x02\x02":
+                # Written from a WAL working copy, a memory database cannot be
+                # in WAL mode
+                self.plain_data = self.plain_data[:18] + b"\x01\x01" + self.plain_data[20:]
+            connection.deserialize(self.plain_data)
+            self.plain_data = None
+
+    def detach(self):
+        """Takes the copy of the in-memory database to write back, call it
+        before closing the connection passed to attach()"""
+        if self.connection is not None:
+            self.plain_data = self.connection.serialize()
+            self.connection = None
+
+    def _open_paged(self):
+        """Opens the page encrypted database, a database still in the whole
+        file format is migrated on the fly"""
+        if self.shared and not is_page_file(self.database_name):
+            # Left for the next writer to migrate
+            self.db_encryption.decrypt_stream(self.database_name, self.working_copy)
+            return
+        if not self.fresh and not is_page_file(self.database_name):
+            self._log_info("Migrating %s to the paged format", self.database_name)
+            self.db_encryption.decrypt_stream(self.database_name, self.working_copy)
+            os.remove(self.database_name)
+            page_file = EncryptedPageFile(self.database_name, self.encryption_key)
+            page_file.import_plain(self.working_copy)
+            page_file.close()
+
+        self.page_file = EncryptedPageFile(self.database_name, self.encryption_key)
+        self.page_file.export_plain(self.working_copy)
+        self._log_debug("Decrypted %d pages of %s", self.page_file.pages_decrypted,
+                        self.database_name)
+
+    def checkpoint(self):
+        """Writes back the changes made so far and keeps the working copy"""
+        self._write(checkpoint=True)
+
+    def close(self, read_only=False):
+        """Writes back the changes, removes the working copy and releases
+        the locks
+
+        Args:
+            read_only: nothing was modified, skip writing entirely. Shared
+                sessions never write
+        """
+        try:
+            self._close(read_only)
+        finally:
+            self.writer_lock.release()
+
+    def _close(self, read_only):
+        if self.shared:
+            if not read_only:
+                self._log_info("Not writing back the changes of a read-only session to %s",
+                               self.database_name)
+            read_only = True
+        if self.in_memory:
+            if not read_only:
+                self._write(checkpoint=False)
+            self.detach()
+            self.plain_data = None
+            return
+        if read_only and self.page_file:
+            self.page_file.close()
+            os.remove(self.working_copy)
+            return
+        if read_only and self.working_copy in self.db_encryption.snapshots:
+            # Nothing changed, the encrypted file and checksums are still valid
+            self.db_encryption.discard_working_copy(self.working_copy)
+            return
+        if self.shared:
+            if os.path.exists(self.working_copy):
+                os.remove(self.working_copy)
+            return
+        self._write(checkpoint=False)
+        os.remove(self.working_copy)
+
+    def _write(self, checkpoint):
+        if os.path.exists(self.working_copy + "-wal"):
+            # Changes still in the WAL are not in the working copy file yet.
+            # A connection of its own, the caller may be on any thread
+            connection = sqlite3.connect(self.working_copy)
+            try:
+                connection.execute("PRAGMA wal_checkpoint(FULL)")
+            finally:
+                connection.close()
+        with self.data_lock.hold():
+            self._write_locked(checkpoint)
+
+    def _write_locked(self, checkpoint):
+        if self.page_file:
+            written = self.page_file.import_plain(self.working_copy)
+            if not checkpoint:
+                self.page_file.close()
+            self._log_debug("Encrypted %d changed pages of %s", written, self.database_name)
+            return
+
+        if self.in_memory:
+            # serialize() copies the database out of sqlite, straight into the cipher
+            data = self.connection.serialize() if self.connection else self.plain_data
+            database_name, encryptedmd5, pmd5 = self.db_encryption.encrypt_bytes(
+                data, self.database_name)
+        else:
+            database_name, encryptedmd5, pmd5 = self.db_encryption.encrypt_database(
+                self.working_copy, checkpoint)
+        self._log_debug("Database file: %s encrypted %s: %s", database_name, self.digest,
+                        encryptedmd5)
+
+        self.table_config.set(self.encrypted_key, encryptedmd5)
+        self.table_config.set(self.plain_key, pmd5)
+        self.table_config.overwrite()
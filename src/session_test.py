@@ -0,0 +1,141 @@
+"""Unit test for the DatabaseSession"""
+import base64
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from config import TableConfig
+from session import DatabaseSession, ChecksumError
+
+class TestDatabaseSession(unittest.TestCase):
+    """TestDatabaseSession class"""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database_name = os.path.join(self.temp_dir.name, "test.db.enc")
+        self.config_file = os.path.join(self.temp_dir.name, "config.json")
+        self.key = b'test_key_16bytes'
+        self._write_config({})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_config(self, extra):
+        config_data = {
+            "encryption_key": base64.b64encode(self.key).decode('utf-8'),
+            "database_name": self.database_name,
+            "table_name": "users",
+        }
+        config_data.update(extra)
+        with open(self.config_file, 'w', encoding='utf-8') as file:
+            json.dump(config_data, file)
+
+    def _session(self):
+        return DatabaseSession(TableConfig(self.config_file), self.key)
+
+    def _insert(self, working_copy, name):
+        conn = sqlite3.connect(working_copy)
+        conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT)")
+        conn.execute("INSERT INTO users VALUES (?)", (name,))
+        conn.commit()
+        conn.close()
+
+    def _names(self):
+        session = self._session()
+        conn = sqlite3.connect(session.open())
+        names = [row[0] for row in conn.execute("SELECT name FROM users")]
+        conn.close()
+        session.close(read_only=True)
+        return names
+
+    def test_fresh_round_trip(self):
+        session = self._session()
+        working_copy = session.open()
+        self.assertTrue(session.fresh)
+        self._insert(working_copy, "Alice")
+        session.close()
+
+        self.assertFalse(os.path.exists(working_copy))
+        self.assertTrue(os.path.exists(self.database_name))
+        self.assertEqual(self._names(), ["Alice"])
+
+    def test_read_only_close_keeps_file(self):
+        session = self._session()
+        self._insert(session.open(), "Alice")
+        session.close()
+        before = os.stat(self.database_name).st_mtime_ns
+
+        self.assertEqual(self._names(), ["Alice"])
+        self.assertEqual(os.stat(self.database_name).st_mtime_ns, before)
+
+    def test_checksum_mismatch(self):
+        session = self._session()
+        self._insert(session.open(), "Alice")
+        session.close()
+
+        table_config = TableConfig(self.config_file)
+        table_config.set("emd5", "0" * 32)
+        table_config.overwrite()
+        session = self._session()
+        with self.assertRaises(ChecksumError):
+            session.open()
+        self.assertFalse(os.path.exists(session.working_copy))
+
+    def test_checkpoint(self):
+        session = self._session()
+        working_copy = session.open()
+        self._insert(working_copy, "Alice")
+        session.checkpoint()
+        self.assertTrue(os.path.exists(working_copy))
+        self._insert(working_copy, "Bob")
+        session.checkpoint()
+
+        # The encrypted file is complete without closing the session
+        os.rename(working_copy, working_copy + ".bak")
+        self.assertEqual(self._names(), ["Alice", "Bob"])
+        os.rename(working_copy + ".bak", working_copy)
+        session.close()
+
+    def test_paged_storage(self):
+        self._write_config({"storage": "paged"})
+        session = self._session()
+        self._insert(session.open(), "Alice")
+        session.close()
+        self.assertEqual(self._names(), ["Alice"])
+
+    def _memory_session(self, name=None, read_only=False):
+        session = self._session()
+        conn = sqlite3.connect(session.open())
+        session.attach(conn)
+        conn.execute("CREATE TABLE IF NOT EXISTS users (name TEXT)")
+        if name:
+            conn.execute("INSERT INTO users VALUES (?)", (name,))
+            conn.commit()
+        names = [row[0] for row in conn.execute("SELECT name FROM users")]
+        session.detach()
+        conn.close()
+        session.close(read_only=read_only)
+        return names
+
+    def test_memory_storage(self):
+        self._write_config({"storage": "memory"})
+        self._memory_session("Alice")
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ["config.json", "test.db.enc"])
+        self.assertEqual(self._memory_session("Bob"), ["Alice", "Bob"])
+        self.assertEqual(self._memory_session(read_only=True), ["Alice", "Bob"])
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ["config.json", "test.db.enc"])
+
+        # The file is interchangeable with the one written through a working copy
+        self._write_config({"emd5": TableConfig(self.config_file).get("emd5")})
+        self.assertEqual(self._names(), ["Alice", "Bob"])
+
+    def test_memory_storage_checksum_mismatch(self):
+        self._write_config({"storage": "memory"})
+        self._memory_session("Alice")
+        self._write_config({"storage": "memory", "emd5": "0" * 32})
+        with self.assertRaises(ChecksumError):
+            self._session().open()
+
+if __name__ == '__main__':
+    unittest.main()
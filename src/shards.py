@@ -0,0 +1,235 @@
+"""Routes the operations on a table split over several shards
+
+Each shard is a table, usually in a database file of its own. Rows go to
+the shard picked by a hash of their shard key, the email by default, so
+the same record always lands in the same shard. Reads that span every
+shard query them in parallel.
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from db import (DEFAULT_BUFFER_ROWS, DEFAULT_BUFFER_SECONDS, DEFAULT_FETCH_SIZE,
+                DEFAULT_PAGE_SIZE, WriteBuffer)
+from records import Columns
+
+DEFAULT_SHARD_KEY = "email"
+
+def shard_index(key, shards):
+    """Returns the shard of key, stable across processes unlike hash()"""
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+class ShardRegistry:
+    """Offers the DatabaseManager methods the actions use, for a table
+    split over several shards
+
+    The methods take the name of the logical table and run on the tables
+    of the shards. A transaction spans every shard but each commits on
+    its own, it is not atomic across them.
+
+    Args:
+        table_name: name the actions use for the table
+        shards: list of (DatabaseManager, table name) pairs, the managers
+            need check_same_thread=False for the parallel reads
+        shard_key: column whose value picks the shard of a row
+    """
+    def __init__(self, table_name, shards, shard_key=DEFAULT_SHARD_KEY):
+        if not shards:
+            raise ValueError("A sharded table needs at least one shard")
+        self.table_name = table_name
+        self.shards = shards
+        self.shard_key = shard_key
+        self._executor = ThreadPoolExecutor(len(shards), thread_name_prefix="shard")
+
+    def _check_table(self, table_name):
+        if table_name != self.table_name:
+            raise ValueError(f"Unknown table {table_name!r}, the shards hold {self.table_name!r}")
+
+    def _parallel(self, function, shards=None):
+        """Calls function(db_manager, table) for each shard concurrently
+
+        Returns:
+            list of the results, in shard order
+        """
+        shards = self.shards if shards is None else shards
+        return list(self._executor.map(lambda shard: function(*shard), shards))
+
+    def _split(self, table_name, rows, key_position):
+        """Groups the rows by shard
+
+        Returns:
+            list of (shard, rows) for the shards receiving rows
+        """
+        self._check_table(table_name)
+        groups = [[] for _ in self.shards]
+        for row in rows:
+            key = row if key_position is None else row[key_position]
+            groups[shard_index(key, len(self.shards))].append(row)
+        return [(shard, group) for shard, group in zip(self.shards, groups) if group]
+
+    def _key_position(self):
+        db_manager, table = self.shards[0]
+        return db_manager.data_columns(table).index(self.shard_key)
+
+    @contextmanager
+    def transaction(self):
+        """Opens a transaction on every shard, see DatabaseManager.transaction()"""
+        with ExitStack() as stack:
+            for db_manager, _ in self.shards:
+                stack.enter_context(db_manager.transaction())
+            yield self
+
+    def write_buffer(self, table_name, max_rows=DEFAULT_BUFFER_ROWS,
+                     max_seconds=DEFAULT_BUFFER_SECONDS, unique=True):
+        self._check_table(table_name)
+        return WriteBuffer(self, table_name, max_rows, max_seconds, unique)
+
+    def data_columns(self, table_name):
+        self._check_table(table_name)
+        db_manager, table = self.shards[0]
+        return db_manager.data_columns(table)
+
+    #################################################
+    # Writes, each shard receives its own rows
+
+    def insert_data(self, table_name, data):
+        for (db_manager, table), rows in self._split(table_name, data, self._key_position()):
+            db_manager.insert_data(table, rows)
+
+    def upsert(self, table_name, data, key=DEFAULT_SHARD_KEY):
+        """See DatabaseManager.upsert(), key has to be the shard key so a
+        record is only ever in one shard"""
+        if key != self.shard_key:
+            raise ValueError(f"Upserts on {key!r} need the table sharded on it")
+        return sum(db_manager.upsert(table, rows, key) for (db_manager, table), rows
+                   in self._split(table_name, data, self._key_position()))
+
+    def delete_many(self, table_name, emails):
+        if self.shard_key != "email":
+            # The email does not tell the shard, each one has to look
+            self._check_table(table_name)
+            emails = list(emails)
+            return sum(self._parallel(lambda db_manager, table:
+                                      db_manager.delete_many(table, emails)))
+        return sum(db_manager.delete_many(table, group) for (db_manager, table), group
+                   in self._split(table_name, emails, None))
+
+    def delete_all(self, table_name):
+        self._check_table(table_name)
+        return sum(self._parallel(lambda db_manager, table: db_manager.delete_all(table)))
+
+    #################################################
+    # Reads spanning every shard
+
+    def fetch_page(self, table_name, page_size=DEFAULT_PAGE_SIZE, after=None, **query):
+        """Reads one page of rows, shard after shard
+
+        The next page of every shard left is read in parallel, the rows of
+        the later shards fill the page when the earlier ones run out.
+
+        Args:
+            after: cursor returned with the previous page, it combines the
+                shard and the rowid within it
+
+        Returns:
+            (rows, cursor of the last row or None when there are no rows)
+        """
+        self._check_table(table_name)
+        count = len(self.shards)
+        first, rowid = (0, None) if after is None else (after % count, after // count)
+
+        def read(index, size):
+            db_manager, table = self.shards[index]
+            return db_manager.fetch_page(table, size, rowid if index == first else None,
+                                         **query)
+
+        pages = list(self._executor.map(lambda index: read(index, page_size),
+                                        range(first, count)))
+        rows, last = [], None
+        for index, (page, last_rowid) in enumerate(pages, first):
+            wanted = page_size - len(rows)
+            if len(page) > wanted:
+                # Read again as many rows as fit, for the rowid of the last one
+                page, last_rowid = read(index, wanted)
+            if page:
+                rows += page
+                last = last_rowid * count + index
+            if len(rows) >= page_size:
+                break
+        return rows, last
+
+    def iter_rows(self, table_name, limit=None, page_size=DEFAULT_PAGE_SIZE, after=None,
+                  **query):
+        """Yields the rows of every shard, see DatabaseManager.iter_rows()
+
+        The shards are read in parallel one page at a time, their rows are
+        interleaved page by page. after is a cursor of fetch_page().
+        """
+        if after is not None:
+            # Resuming from a cursor follows the order of fetch_page()
+            while limit is None or limit > 0:
+                size = page_size if limit is None else min(page_size, limit)
+                rows, after = self.fetch_page(table_name, size, after, **query)
+                yield from rows
+                if len(rows) < size:
+                    return
+                if limit is not None:
+                    limit -= len(rows)
+            return
+
+        self._check_table(table_name)
+        cursors = {index: None for index in range(len(self.shards))}
+        while cursors and (limit is None or limit > 0):
+            size = page_size if limit is None else min(page_size, limit)
+            indexes = list(cursors)
+            pages = self._executor.map(
+                lambda index: self.shards[index][0].fetch_page(
+                    self.shards[index][1], size, cursors[index], **query), indexes)
+            for index, (rows, last_rowid) in zip(indexes, list(pages)):
+                if limit is not None:
+                    rows = rows[:limit]
+                    limit -= len(rows)
+                yield from rows
+                if len(rows) < size:
+                    del cursors[index]
+                else:
+                    cursors[index] = last_rowid
+
+    def iter_data(self, table_name, fetch_size=DEFAULT_FETCH_SIZE):
+        """Reads every shard, see DatabaseManager.iter_data()
+
+        Returns:
+            (column names, generator of rows)
+        """
+        self._check_table(table_name)
+        db_manager, table = self.shards[0]
+        return list(db_manager.column_names(table)), self.iter_rows(table_name,
+                                                                    page_size=fetch_size)
+
+    def iter_records(self, table_name, **query):
+        """Yields the rows of every shard as Record instances"""
+        self._check_table(table_name)
+        db_manager, table = self.shards[0]
+        record = db_manager.record_class(table)
+        for row in self.iter_rows(table_name, **query):
+            yield record(*row)
+
+    def fetch_columns(self, table_name, use_numpy=None, page_size=DEFAULT_FETCH_SIZE,
+                      **query):
+        """Reads every shard column by column, see DatabaseManager.fetch_columns()"""
+        self._check_table(table_name)
+        db_manager, table = self.shards[0]
+        columns = Columns(*db_manager.table_info(table))
+        rows = []
+        for row in self.iter_rows(table_name, page_size=page_size, **query):
+            rows.append(row)
+            if len(rows) >= page_size:
+                columns.extend(rows)
+                rows = []
+        columns.extend(rows)
+        return columns.to_dict(use_numpy)
+
+    def close_connection(self):
+        self._executor.shutdown()
+        for db_manager, _ in self.shards:
+            db_manager.close_connection()
@@ -0,0 +1,78 @@
+"""Unit tests for the ShardRegistry"""
+import unittest
+from db import DatabaseManager
+from shards import ShardRegistry, shard_index
+
+COLUMNS = [
+    {"name": "id", "type": "INTEGER", "primary_key": True},
+    {"name": "name", "type": "TEXT", "not_null": True},
+    {"name": "email", "type": "TEXT", "not_null": True, "unique": True}
+]
+
+class TestShardRegistry(unittest.TestCase):
+    def setUp(self):
+        self.managers = []
+        shards = []
+        for index in range(3):
+            db_manager = DatabaseManager(":memory:", check_same_thread=False)
+            db_manager.create_table(f"users_{index}", COLUMNS)
+            self.managers.append(db_manager)
+            shards.append((db_manager, f"users_{index}"))
+        self.registry = ShardRegistry("users", shards)
+        self.rows = [(f"user{i}", f"user{i}@example.com") for i in range(20)]
+        self.registry.upsert("users", self.rows)
+
+    def tearDown(self):
+        self.registry.close_connection()
+
+    def test_rows_go_to_their_shard(self):
+        for row in self.rows:
+            db_manager = self.managers[shard_index(row[1], 3)]
+            table = f"users_{shard_index(row[1], 3)}"
+            db_manager.cursor.execute(f"SELECT name FROM {table} WHERE email = ?", (row[1],))
+            self.assertEqual(db_manager.cursor.fetchone(), (row[0],))
+        self.assertEqual(sum(len(manager.fetch_data(f"users_{index}"))
+                             for index, manager in enumerate(self.managers)), 20)
+
+    def test_iter_rows_reads_every_shard(self):
+        rows = list(self.registry.iter_rows("users", page_size=3))
+        self.assertEqual(sorted(row[1:] for row in rows), sorted(self.rows))
+        self.assertEqual(len(list(self.registry.iter_rows("users", limit=7, page_size=2))), 7)
+
+    def test_fetch_page_cursor(self):
+        seen = []
+        after = None
+        while True:
+            rows, after = self.registry.fetch_page("users", 6, after)
+            seen += rows
+            if len(rows) < 6:
+                break
+        self.assertEqual(sorted(row[1:] for row in seen), sorted(self.rows))
+        self.assertEqual(len(list(self.registry.iter_rows("users", after=None, limit=20))), 20)
+
+    def test_deletes(self):
+        self.assertEqual(self.registry.delete_many("users", ["user1@example.com",
+                                                             "user2@example.com"]), 2)
+        self.assertEqual(self.registry.delete_all("users"), 18)
+        self.assertEqual(list(self.registry.iter_rows("users")), [])
+
+    def test_write_buffer(self):
+        with self.registry.write_buffer("users") as write_buffer:
+            write_buffer.insert(("renamed", "user3@example.com"))
+            write_buffer.insert(("new", "new@example.com"))
+        rows = {row[2]: row[1] for row in self.registry.iter_rows("users")}
+        self.assertEqual((rows["user3@example.com"], rows["new@example.com"]), ("renamed", "new"))
+
+    def test_records_and_columns(self):
+        records = list(self.registry.iter_records("users"))
+        self.assertEqual(sorted(record.email for record in records),
+                         sorted(row[1] for row in self.rows))
+        columns = self.registry.fetch_columns("users", use_numpy=False)
+        self.assertEqual(len(columns["id"]), 20)
+
+    def test_unknown_table(self):
+        with self.assertRaises(ValueError):
+            self.registry.delete_all("posts")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""Streaming import and export of table rows as CSV or JSON lines
+
+Rows flow through generators, so memory use does not depend on the size
+of the file or of the table.
+"""
+import csv
+import json
+import os
+import time
+
+CSV_FORMAT = "csv"
+JSONL_FORMAT = "jsonl"
+FORMATS = (CSV_FORMAT, JSONL_FORMAT)
+# Rows per executemany call and per commit
+DEFAULT_IMPORT_CHUNK = 10000
+# Rows between two progress reports
+DEFAULT_PROGRESS_EVERY = 100000
+IMPORT_COLUMNS = ("name", "email")
+
+def guess_format(file_path):
+    """Returns the format matching the file extension
+
+    Raises:
+        ValueError: the extension is not a known format
+    """
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    if extension == "json":
+        extension = JSONL_FORMAT
+    if extension not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {file_path}, use csv or jsonl")
+    return extension
+
+def read_records(file, file_format):
+    """Yields the records of an open text file as dicts
+
+    CSV files need a header naming the columns, JSON lines files hold one
+    object per line.
+    """
+    if file_format == CSV_FORMAT:
+        return csv.DictReader(file)
+    return (json.loads(line) for line in file if line.strip())
+
+def read_rows(file, file_format):
+    """Yields (name, email) tuples from an open text file, other columns
+    are ignored"""
+    for record in read_records(file, file_format):
+        yield tuple(record[column] for column in IMPORT_COLUMNS)
+
+def write_rows(file, file_format, columns, rows):
+    """Writes rows to an open text file
+
+    Args:
+        file: text file opened for writing
+        file_format: csv or jsonl
+        columns: column names, written as the CSV header or the JSON keys
+        rows: iterable of tuples
+
+    Returns:
+        number of rows written
+    """
+    count = 0
+    if file_format == CSV_FORMAT:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(dict(zip(columns, row))) + "\n")
+            count += 1
+    return count
+
+def chunked(rows, size):
+    """Groups an iterable into lists of at most size items"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class Progress:
+    """Counts rows and reports the throughput every so often
+
+    Args:
+        report: callable taking (rows, rows_per_second), None to stay quiet
+        every: rows between two reports
+    """
+    def __init__(self, report=None, every=DEFAULT_PROGRESS_EVERY):
+        self.report = report
+        self.every = every
+        self.rows = 0
+        self.start = time.perf_counter()
+        self._next = every
+
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.start
+        return self.rows / elapsed if elapsed else 0.0
+
+    def track(self, rows):
+        """Yields the rows unchanged while counting them"""
+        for row in rows:
+            yield row
+            self.rows += 1
+            if self.rows >= self._next:
+                self._next += self.every
+                if self.report:
+                    self.report(self.rows, self.rows_per_second())
+
+    def done(self):
+        """Reports the final count"""
+        if self.report:
+            self.report(self.rows, self.rows_per_second())
+        return self.rows
+
+def import_file(db_manager, table_name, file_path, file_format=None, unique=True,
+                chunk_size=DEFAULT_IMPORT_CHUNK, report=None):
+    """Loads a CSV or JSON lines file into the table
+
+    Each chunk is inserted with one executemany call and committed on its
+    own, an interrupted import keeps the chunks loaded so far.
+
+    Returns:
+        number of rows imported
+    """
+    file_format = file_format or guess_format(file_path)
+    insert = db_manager.upsert if unique else db_manager.insert_data
+    progress = Progress(report)
+    with open(file_path, newline="", encoding="utf-8") as file:
+        for chunk in chunked(progress.track(read_rows(file, file_format)), chunk_size):
+            insert(table_name, chunk)
+    return progress.done()
+
+def delete_file(db_manager, table_name, file_path, file_format=None):
+    """Deletes the records whose email is listed in a CSV or JSON lines
+    file, in a single statement and transaction
+
+    Returns:
+        number of rows deleted
+    """
+    file_format = file_format or guess_format(file_path)
+    with open(file_path, newline="", encoding="utf-8") as file:
+        emails = (record["email"] for record in read_records(file, file_format))
+        return db_manager.delete_many(table_name, emails)
+
+def export_file(db_manager, table_name, file_path, file_format=None, fetch_size=None,
+                report=None):
+    """Writes every row of the table to a CSV or JSON lines file, fetch_size
+    rows at a time, DatabaseManager's default when None
+
+    Returns:
+        number of rows exported
+    """
+    file_format = file_format or guess_format(file_path)
+    if fetch_size:
+        columns, rows = db_manager.iter_data(table_name, fetch_size)
+    else:
+        columns, rows = db_manager.iter_data(table_name)
+    progress = Progress(report)
+    with open(file_path, "w", newline="", encoding="utf-8") as file:
+        write_rows(file, file_format, columns, progress.track(rows))
+    return progress.done()
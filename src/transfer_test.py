@@ -0,0 +1,86 @@
+"""Unit test for the streaming import and export"""
+import json
+import os
+import tempfile
+import unittest
+
+from db import DatabaseManager
+from transfer import import_file, export_file, delete_file, guess_format, chunked, Progress
+
+class TestTransfer(unittest.TestCase):
+    """TestTransfer class"""
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(":memory:")
+        self.table_name = "users"
+        self.db_manager.create_table(self.table_name, [
+            {"name": "id", "type": "INTEGER", "primary_key": True},
+            {"name": "name", "type": "TEXT", "not_null": True},
+            {"name": "email", "type": "TEXT", "unique": True}
+        ])
+
+    def tearDown(self):
+        self.db_manager.close_connection()
+        self.temp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def test_guess_format(self):
+        self.assertEqual(guess_format("users.CSV"), "csv")
+        self.assertEqual(guess_format("users.json"), "jsonl")
+        with self.assertRaises(ValueError):
+            guess_format("users.txt")
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_csv_round_trip(self):
+        with open(self.path("in.csv"), "w", encoding="utf-8") as file:
+            file.write("email,name\n")
+            for i in range(25):
+                file.write(f"user{i}@example.com,user{i}\n")
+        reports = []
+        count = import_file(self.db_manager, self.table_name, self.path("in.csv"),
+                            chunk_size=10, report=lambda rows, rate: reports.append(rows))
+        self.assertEqual(count, 25)
+        self.assertEqual(reports[-1], 25)
+
+        count = export_file(self.db_manager, self.table_name, self.path("out.csv"),
+                            fetch_size=7)
+        self.assertEqual(count, 25)
+        with open(self.path("out.csv"), encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[0], "id,name,email")
+        self.assertEqual(lines[1], "1,user0,user0@example.com")
+        self.assertEqual(len(lines), 26)
+
+    def test_jsonl_round_trip(self):
+        with open(self.path("in.jsonl"), "w", encoding="utf-8") as file:
+            file.write(json.dumps({"name": "Alice", "email": "alice@example.com"}) + "\n\n")
+            file.write(json.dumps({"name": "Bob", "email": "bob@example.com"}) + "\n")
+        import_file(self.db_manager, self.table_name, self.path("in.jsonl"))
+        export_file(self.db_manager, self.table_name, self.path("out.json"))
+        with open(self.path("out.json"), encoding="utf-8") as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(records, [{"id": 1, "name": "Alice", "email": "alice@example.com"},
+                                   {"id": 2, "name": "Bob", "email": "bob@example.com"}])
+
+    def test_delete_file(self):
+        self.db_manager.insert_data(self.table_name, [("Alice", "alice@example.com"),
+                                                      ("Bob", "bob@example.com")])
+        with open(self.path("gone.csv"), "w", encoding="utf-8") as file:
+            file.write("email\nalice@example.com\ncarol@example.com\n")
+        self.assertEqual(delete_file(self.db_manager, self.table_name, self.path("gone.csv")), 1)
+        self.assertEqual(self.db_manager.fetch_data(self.table_name),
+                         [(2, "Bob", "bob@example.com")])
+
+    def test_progress(self):
+        reports = []
+        progress = Progress(lambda rows, rate: reports.append(rows), every=2)
+        self.assertEqual(list(progress.track("abcde")), list("abcde"))
+        self.assertEqual(progress.done(), 5)
+        self.assertEqual(reports, [2, 4, 5])
+
+if __name__ == '__main__':
+    unittest.main()